@@ -0,0 +1,146 @@
+# SPDX-License-Identifier: CC0-1.0
+# carotte.py by Twal, hbens & more
+
+'''Benchmarks of the elaboration, emission and optimization of the netlists
+
+Run `python -m benchmarks.bench` from the repository root. Each circuit of `benchmarks/circuits.py`
+is built at each size in a new process, which measures the elaboration time, the `get_netlist()`
+time, the `carotte_opt.optimize()` time, its peak memory and the netlist size. The results are
+compared to the baseline file: a time or peak memory above the baseline by more than the tolerance,
+or a different netlist, is a regression. `--save` replaces the baseline by the results.
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import typing
+
+try:
+    import resource
+except ModuleNotFoundError:
+    resource = None # type: ignore
+
+import carotte_opt
+import lib_carotte
+from benchmarks.circuits import CIRCUITS
+
+SIZES = (10**3, 10**4, 10**5, 10**6, 10**7)
+DEFAULT_MAX_SIZE = 10**5
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# Measures compared with the tolerance, the other ones must be equal
+MEASURES = ("elaboration", "emission", "optimization", "peak_memory")
+# Time differences below this many seconds are noise, not regressions
+TIME_NOISE = 0.05
+
+Result = typing.Dict[str, typing.Any]
+
+def peak_memory() -> typing.Optional[float]:
+    '''Peak resident memory of this process, in MiB'''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB elsewhere
+    return round(peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10), 1)
+
+def run_case(circuit: str, size: int, optimize: bool) -> Result:
+    '''Build a circuit in this process, and measure it'''
+    lib_carotte.reset()
+    start = time.perf_counter()
+    CIRCUITS[circuit](size)
+    lib_carotte.resolve_defers()
+    elaboration = round(time.perf_counter() - start, 4)
+    equations = len(lib_carotte.get_equations())
+    start = time.perf_counter()
+    netlist = lib_carotte.get_netlist()
+    emission = round(time.perf_counter() - start, 4)
+    netlist_bytes = len(netlist.encode())
+    del netlist
+    (optimization, optimized_equations) = (None, None)
+    if optimize:
+        start = time.perf_counter()
+        carotte_opt.optimize()
+        optimization = round(time.perf_counter() - start, 4)
+        optimized_equations = len(lib_carotte.get_equations())
+    return {"equations": equations, "netlist_bytes": netlist_bytes, "optimized_equations": optimized_equations,
+            "elaboration": elaboration, "emission": emission, "optimization": optimization,
+            "peak_memory": peak_memory()}
+
+def measure(circuit: str, size: int, optimize: bool) -> Result:
+    '''Measure a circuit in a new process, so that its peak memory is its own'''
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, "-m", "benchmarks.bench", "--case", circuit, str(size)]
+    output = subprocess.run(command + ([] if optimize else ["--no-optimize"]),
+                            cwd=root, check=True, stdout=subprocess.PIPE, text=True).stdout
+    result: Result = json.loads(output)
+    return result
+
+def regressions(result: Result, baseline: Result, tolerance: float) -> typing.List[str]:
+    '''Differences between a result and its baseline that are regressions'''
+    found = []
+    for (name, value) in result.items():
+        expected = baseline.get(name)
+        if value is None or expected is None:
+            continue
+        if name not in MEASURES:
+            if value != expected:
+                found.append(f"{name} {expected} -> {value}")
+        elif value > expected * (1 + tolerance) and (name == "peak_memory" or value - expected > TIME_NOISE):
+            found.append(f"{name} {expected:.3f} -> {value:.3f} (+{100 * (value / expected - 1):.0f}%)")
+    return found
+
+def main() -> None:
+    '''Entry point of the benchmarks'''
+    parser = argparse.ArgumentParser(description='carotte.py benchmarks')
+    parser.add_argument('circuits', nargs='*', help=f'Circuits to measure, among {", ".join(CIRCUITS)} (default: all)')
+    parser.add_argument('--max-size', type=int, default=DEFAULT_MAX_SIZE,
+                        help=f'Largest number of equations, among {", ".join(map(str, SIZES))}')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline file (JSON)')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='Relative increase of a time or of the peak memory above which it is a regression')
+    parser.add_argument('--no-optimize', action='store_true',
+                        help='Do not measure the optimization, which takes most of the time of the large sizes')
+    parser.add_argument('--save', action='store_true', help='Save the results as the new baseline')
+    parser.add_argument('--case', nargs=2, metavar=('CIRCUIT', 'SIZE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.case is not None:
+        print(json.dumps(run_case(args.case[0], int(args.case[1]), not args.no_optimize)))
+        return
+    for circuit in args.circuits:
+        if circuit not in CIRCUITS:
+            parser.error(f"unknown circuit '{circuit}'")
+
+    baselines: typing.Dict[str, Result] = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baselines = json.load(f)
+    results: typing.Dict[str, Result] = {}
+    failures = 0
+    print(f"{'circuit':<16} {'size':>8} {'equations':>9} {'elab':>8} {'emit':>8} {'opt':>8} {'peak':>9} "
+          f"{'netlist':>10}")
+    for circuit in args.circuits or CIRCUITS:
+        for size in (size for size in SIZES if size <= args.max_size):
+            key = f"{circuit}/{size}"
+            result = results[key] = measure(circuit, size, not args.no_optimize)
+            optimization = "-" if result["optimization"] is None else f"{result['optimization']:.3f}s"
+            memory = "?" if result["peak_memory"] is None else f"{result['peak_memory']:.1f}MiB"
+            print(f"{circuit:<16} {size:>8} {result['equations']:>9} {result['elaboration']:>7.3f}s "
+                  f"{result['emission']:>7.3f}s {optimization:>8} {memory:>9} "
+                  f"{result['netlist_bytes']:>10}", flush=True)
+            found = regressions(result, baselines[key], args.tolerance) if key in baselines else []
+            if found:
+                failures += 1
+                print(f"  REGRESSION: {', '.join(found)}", flush=True)
+    if args.save:
+        baselines.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, indent=1, sort_keys=True)
+            f.write("\n")
+    elif failures:
+        print(f"{failures} regression(s) against {args.baseline}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
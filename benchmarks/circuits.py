@@ -0,0 +1,86 @@
+# SPDX-License-Identifier: CC0-1.0
+# carotte.py by Twal, hbens & more
+
+'''Parameterized circuits of the benchmarks
+
+Each generator builds its circuit in the active circuit by adding copies of a block
+until the netlist holds at least `size` equations, so that the sizes are comparable.
+'''
+
+import typing
+
+from examples import nadder, ram
+from lib_carotte import *
+
+WIDTH = 32
+OR_WIDTH = 64
+MEMORY_ADDR_SIZE = 10
+
+def ripple_adders(size: int) -> None:
+    '''Chain of n-bit ripple-carry adders (examples/nadder.py)'''
+    a = Input(WIDTH, "a")
+    carry: Variable = Input(1, "c")
+    x: Variable = a
+    while len(get_equations()) < size:
+        (x, carry) = nadder.adder(x, a, carry)
+    x.set_as_output("s")
+    carry.set_as_output("c_out")
+
+def or_reductions(size: int) -> None:
+    '''Wide bitwise ORs (examples/ram.py), each one reduced to a bit by halving the bus'''
+    a = Input(OR_WIDTH, "a")
+    x: Variable = Input(OR_WIDTH, "b")
+    bits = []
+    while len(get_equations()) < size:
+        x = ram.or_n_iter(x, a)
+        reduced: Variable = x
+        while reduced.bus_size > 1:
+            half = reduced.bus_size // 2
+            reduced = ram.or_n_iter(reduced[:half], reduced[half:])
+        bits.append(reduced)
+    concat_all(bits).set_as_output("o")
+
+def pipelines(size: int) -> None:
+    '''Pipeline stages: a register per bit, between thin layers of logic'''
+    x: Variable = Input(WIDTH, "a")
+    while len(get_equations()) < size:
+        x = concat_all(Reg(x[i] ^ x[(i + 1) % WIDTH]) for i in range(WIDTH))
+    x.set_as_output("o")
+
+def shift_register(enable: Variable) -> Variable:
+    '''Shift register whose feedback goes through Defer nodes, returns its first bit'''
+    nexts: Variable
+    regs = reg_bus(WIDTH, lambda: nexts)
+    nexts = concat_all(Mux(enable, regs[i], regs[(i - 1) % WIDTH] ^ regs[(i - 2) % WIDTH])
+                       for i in range(WIDTH))
+    return regs[0]
+
+def feedback_loops(size: int) -> None:
+    '''Shift registers whose feedback goes through Defer nodes'''
+    enable = Input(1, "enable")
+    outputs = []
+    while len(get_equations()) < size:
+        outputs.append(shift_register(enable))
+    concat_all(outputs).set_as_output("o")
+
+def memories(size: int) -> None:
+    '''Banks of ROMs and RAMs, the output selecting one of them'''
+    addr = Input(MEMORY_ADDR_SIZE, "addr")
+    select = Input(WIDTH, "select")
+    write_enable = Input(1, "we")
+    data: Variable = Input(WIDTH, "data")
+    bank = 0
+    while len(get_equations()) < size:
+        rom = ROM(MEMORY_ADDR_SIZE, WIDTH, addr)
+        memory = RAM(MEMORY_ADDR_SIZE, WIDTH, addr, write_enable & select[bank % WIDTH], addr, rom)
+        data = Mux(select[bank % WIDTH], data, memory)
+        bank += 1
+    data.set_as_output("o")
+
+CIRCUITS: typing.Dict[str, typing.Callable[[int], None]] = {
+    "adders": ripple_adders,
+    "or_reductions": or_reductions,
+    "pipelines": pipelines,
+    "feedback_loops": feedback_loops,
+    "memories": memories,
+}
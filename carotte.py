@@ -5,16 +5,21 @@
 '''Entry point of the carotte.py DSL'''
 
 import argparse
+import ast
+import glob
+import hashlib
+import importlib.util
+import marshal
+import multiprocessing
 import os
 import re
+import shutil
 import sys
-
-try:
-    if sys.version_info < (3, 13):
-        import colored_traceback  # type: ignore
-        colored_traceback.add_hook(always=True)
-except ModuleNotFoundError:
-    print("Warning: Install module 'colored_traceback' for better tracebacks", file=sys.stderr)
+import sysconfig
+import time
+import traceback
+import types
+import typing
 
 try:
     import assignhooks  # type: ignore
@@ -28,6 +33,10 @@ except ModuleNotFoundError:
     print("Warning: Install module 'assignhooks' for better variable names", file=sys.stderr)
     assignhooks = None
 
+import carotte_binary
+import carotte_opt
+import carotte_parse
+import carotte_profile
 import lib_carotte
 
 MIN_PYTHON = (3, 8)
@@ -35,35 +44,303 @@ if sys.version_info < MIN_PYTHON:
     print("Python %s.%s or later is required" % MIN_PYTHON, file=sys.stderr) # pylint: disable=C0209
     sys.exit(1)
 
-def process(module_file: str, output_filename: str | None = None) -> None:
-    '''Process a carotte.py input python file and build its netlist'''
+def colored_excepthook(exc_type: typing.Type[BaseException], exc_value: BaseException,
+                       exc_traceback: types.TracebackType | None) -> None:
+    '''Print the uncaught exceptions with colored_traceback, only imported when an error happens'''
+    try:
+        import colored_traceback  # type: ignore # pylint: disable=C0415
+        colored_traceback.add_hook(always=True)
+    except ModuleNotFoundError:
+        print("Warning: Install module 'colored_traceback' for better tracebacks", file=sys.stderr)
+        sys.excepthook = sys.__excepthook__
+    sys.excepthook(exc_type, exc_value, exc_traceback)
+
+if sys.version_info < (3, 13):
+    sys.excepthook = colored_excepthook
+
+# Bump this when the cache format or key changes
+CACHE_VERSION = 1
+# Bump this when the instrumented code changes for another reason than the transformer sources
+INSTRUMENTATION_VERSION = 2
+
+def find_module_file(module_name: str, search_dirs: typing.List[str]) -> str | None:
+    '''Path of the source of a local (i.e. not installed) module, if any'''
+    parts = module_name.split(".")
+    for search_dir in search_dirs:
+        for candidate in (os.path.join(search_dir, *parts) + ".py",
+                          os.path.join(search_dir, *parts, "__init__.py")):
+            if os.path.isfile(candidate):
+                return os.path.abspath(candidate)
+    return None
+
+def module_dependencies(module_file: str) -> typing.List[str]:
+    '''Source files of a module and of the local modules it transitively imports'''
+    installed_dirs = tuple(os.path.abspath(sysconfig.get_path(x))
+                           for x in ("stdlib", "platstdlib", "purelib", "platlib"))
+    search_dirs = [os.path.dirname(os.path.abspath(module_file))]
+    search_dirs += [os.path.abspath(x) for x in sys.path if os.path.isdir(x or ".")]
+    search_dirs = [x for x in search_dirs if not x.startswith(installed_dirs)]
+    files = [os.path.abspath(module_file)]
+    if not module_file.endswith(".py"):
+        return files
+    seen = set(files)
+    k = 0
+    while k < len(files):
+        with open(files[k], 'rb') as f:
+            tree = ast.parse(f.read(), files[k])
+        package = os.path.dirname(files[k])
+        for node in ast.walk(tree):
+            candidates = []
+            if isinstance(node, ast.Import):
+                candidates = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom):
+                base = node.module or ""
+                candidates = [base] + [f"{base}.{alias.name}" if base else alias.name for alias in node.names]
+            for name in candidates:
+                if isinstance(node, ast.ImportFrom) and node.level > 0:
+                    relative_dir = package
+                    for _ in range(node.level - 1):
+                        relative_dir = os.path.dirname(relative_dir)
+                    path = find_module_file(name, [relative_dir]) if name else None
+                else:
+                    path = find_module_file(name, search_dirs) if name else None
+                if path is not None and path not in seen:
+                    seen.add(path)
+                    files.append(path)
+        k += 1
+    return files
+
+def netlist_cache_key(module_file: str, optimize: bool, binary: bool, levels: int = 0) -> str:
+    '''Hash of everything the netlist of `module_file` depends on'''
+    tool_files = [__file__, lib_carotte.__file__, carotte_opt.__file__, carotte_binary.__file__,
+                  carotte_parse.__file__]
+    if assignhooks is not None:
+        tool_files.append(alt_transformer.__file__)
+    h = hashlib.sha256()
+    h.update(repr((CACHE_VERSION, sys.version_info[:2], assignhooks is not None, optimize, binary,
+                  levels)).encode())
+    for path in tool_files + module_dependencies(module_file):
+        with open(path, 'rb') as f:
+            h.update(path.encode() + b"\0" + hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+def copy_netlist(netlist_filename: str, output_filename: str | None) -> None:
+    '''Copy a netlist file to the output file, or to the standard output'''
+    with open(netlist_filename, 'rb') as f:
+        if output_filename is None:
+            sys.stdout.flush()
+            shutil.copyfileobj(f, sys.stdout.buffer)
+        else:
+            with open(output_filename, 'wb') as out:
+                shutil.copyfileobj(f, out)
+
+def write_netlist(output_filename: str | None, binary: bool, levels: int = 0) -> None:
+    '''Write the netlist to the output file, or to the standard output
+
+    `levels` is 0 for the creation order, 1 for the levelized order, 2 to also annotate the levels'''
+    if binary:
+        if output_filename is None:
+            sys.stdout.flush()
+            carotte_binary.write_binary_netlist(sys.stdout.buffer, levels > 0)
+        else:
+            with open(output_filename, 'wb') as f:
+                carotte_binary.write_binary_netlist(f, levels > 0)
+    elif output_filename is None:
+        lib_carotte.write_netlist(sys.stdout, levels > 0, levels > 1)
+    else:
+        with open(output_filename, 'w', encoding='utf-8') as f:
+            lib_carotte.write_netlist(f, levels > 0, levels > 1)
+
+def optimize_netlist() -> None:
+    '''Optimize the netlist of the active circuit and report its logic depth'''
+    (depth_before, depth_after) = carotte_opt.optimize()
+    print(f"Logic depth: {depth_before} -> {depth_after}", file=sys.stderr)
+
+def process(module_file: str, output_filename: str | None = None, *, optimize: bool = False,
+            cache_dir: str | None = None, binary: bool = False, profile: bool = False, levels: int = 0) -> None:
+    '''Process a carotte.py input python file (or a text netlist) and build its netlist'''
+    # pylint: disable=R0912
+    if cache_dir is not None and not profile:
+        cached_filename = os.path.join(cache_dir, netlist_cache_key(module_file, optimize, binary, levels)
+                                       + (".bin" if binary else ".net"))
+        if not os.path.isfile(cached_filename):
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_filename = cached_filename + f".{os.getpid()}.tmp"
+            try:
+                process(module_file, tmp_filename, optimize=optimize, binary=binary, levels=levels)
+                os.replace(tmp_filename, cached_filename)
+            finally:
+                if os.path.exists(tmp_filename):
+                    os.remove(tmp_filename)
+        copy_netlist(cached_filename, output_filename)
+        return
+
+    if module_file.endswith(".net"):
+        lib_carotte.reset()
+        carotte_parse.load_netlist(module_file)
+        if optimize:
+            # The netlist may contain ribbon logic operations: its simulator handles them
+            lib_carotte.allow_ribbon_logic_operations(True)
+            optimize_netlist()
+        write_netlist(output_filename, binary, levels)
+        return
+
     module_dir, module_name = os.path.split(os.path.abspath(module_file))
-    sys.path.append(module_dir)
+    if module_dir not in sys.path:
+        sys.path.append(module_dir)
     module_name = re.sub("\\.py$", "", module_name)
+    # In batch mode, another circuit file with the same name may have been imported before
+    previous_module = sys.modules.get(module_name, None)
+    if previous_module is not None and getattr(previous_module, '__file__', None) != os.path.abspath(module_file):
+        del sys.modules[module_name]
     try:
         module = __import__(module_name)
     except ModuleNotFoundError:
         print(f"Could not load file '{module_file}'", file=sys.stderr)
         sys.exit(1)
     if assignhooks is not None:
-        assignhooks.patch_module(module)
+        patch_module(module)
     lib_carotte.reset()
-    module.main() # type: ignore
-
-    netlist = lib_carotte.get_netlist()
-    if output_filename is None:
-        print(netlist, end='')
+    if profile:
+        with carotte_profile.Profiler(stop_files=[__file__]) as profiler:
+            module.main() # type: ignore
+            lib_carotte.resolve_defers()
+        profiler.report(sys.stderr)
     else:
-        with open(output_filename, 'w', encoding='utf-8') as f:
-            f.write(netlist)
+        module.main() # type: ignore
+    if optimize:
+        optimize_netlist()
+
+    write_netlist(output_filename, binary, levels)
+
+def instrumented_code_key(source: bytes) -> bytes:
+    '''Hash of a module source and of the transformer instrumenting it'''
+    h = hashlib.sha256()
+    h.update(repr((INSTRUMENTATION_VERSION, assignhooks.__version__, importlib.util.MAGIC_NUMBER)).encode())
+    for path in (alt_transformer.__file__, assignhooks.transformer.__file__):
+        with open(path, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    h.update(source)
+    return h.digest()
+
+def instrumented_code(module: types.ModuleType) -> types.CodeType:
+    '''Code of a module with the assignhooks instrumentation, cached in __pycache__'''
+    source_file = typing.cast(str, module.__file__).replace('.pyc', '.py')
+    with open(source_file, 'rb') as f:
+        source = f.read()
+    key = instrumented_code_key(source)
+    cache_dir = os.path.join(os.path.dirname(source_file), "__pycache__")
+    cache_file = os.path.join(cache_dir, f"{module.__name__.rpartition('.')[2]}.carotte-"
+                              f"{sys.implementation.cache_tag}.pyc")
+    try:
+        with open(cache_file, 'rb') as f:
+            if f.read(len(key)) == key:
+                return typing.cast(types.CodeType, marshal.load(f))
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    code = compile(assignhooks.patch.patch_node_ast(ast.parse(source, source_file)), source_file, "exec")
+    tmp_file = cache_file + f".{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(tmp_file, 'wb') as f:
+            f.write(key)
+            marshal.dump(code, f)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        # The cache is optional, e.g. in read-only directories
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return code
+
+def patch_module(module: types.ModuleType) -> None:
+    '''Run the module again with the assignhooks instrumentation, like `assignhooks.patch_module`'''
+    exec(instrumented_code(module), module.__dict__) # pylint: disable=W0122
+
+class BatchJob(typing.NamedTuple):
+    '''A circuit file to process in batch mode'''
+    module_file: str
+    output_filename: str
+    optimize: bool
+    cache_dir: str | None
+    binary: bool
+    levels: int
+
+def process_batch_job(job: BatchJob) -> typing.Tuple[float, str | None]:
+    '''Process a circuit file in a batch worker; returns the time it took and the error, if any'''
+    start = time.perf_counter()
+    # Options set by the previous circuit must not leak into this one
+    lib_carotte.allow_ribbon_logic_operations(False)
+    lib_carotte.enable_hash_consing(False)
+    try:
+        process(job.module_file, job.output_filename, optimize=job.optimize, cache_dir=job.cache_dir, binary=job.binary,
+                levels=job.levels)
+    except SystemExit as e:
+        return (time.perf_counter() - start, f"exited with status {e.code}")
+    except Exception: # pylint: disable=W0718
+        return (time.perf_counter() - start, traceback.format_exc(limit=-3).rstrip())
+    return (time.perf_counter() - start, None)
+
+def process_batch(module_files: typing.List[str], output_dir: str, *, optimize: bool = False,
+                  cache_dir: str | None = None, jobs: int | None = None, binary: bool = False, levels: int = 0) -> int:
+    '''Process many circuit files with a pool of worker processes; returns the number of failures'''
+    os.makedirs(output_dir, exist_ok=True)
+    batch_jobs = [BatchJob(module_file, os.path.join(output_dir, os.path.splitext(os.path.basename(module_file))[0]
+                                                     + (".bin" if binary else ".net")),
+                           optimize, cache_dir, binary, levels)
+                  for module_file in module_files]
+    if len(set(job.output_filename for job in batch_jobs)) != len(batch_jobs):
+        print("Several circuit files have the same name, their netlists would overwrite each other",
+              file=sys.stderr)
+        return len(batch_jobs)
+    failures = 0
+    start = time.perf_counter()
+    with multiprocessing.Pool(jobs) as pool:
+        for (job, (duration, error)) in zip(batch_jobs, pool.imap(process_batch_job, batch_jobs)):
+            if error is None:
+                print(f"ok     {duration:8.3f}s  {job.module_file} -> {job.output_filename}", file=sys.stderr)
+            else:
+                failures += 1
+                print(f"FAILED {duration:8.3f}s  {job.module_file}\n{error}", file=sys.stderr)
+    print(f"{len(batch_jobs) - failures} succeeded, {failures} failed in {time.perf_counter() - start:.3f}s",
+          file=sys.stderr)
+    return failures
 
 def main() -> None:
     '''Entry point for carotte.py'''
     parser = argparse.ArgumentParser(description='carotte.py DSL')
-    parser.add_argument("module_file", nargs=1)
+    parser.add_argument("module_file", nargs='+',
+                        help='Circuit file(s) or .net text netlist(s), glob patterns are expanded')
     parser.add_argument('-o', '--output-file', help='Netlist output file')
+    parser.add_argument('-d', '--output-dir',
+                        help='Netlist output directory, one netlist per circuit file (batch mode)')
+    parser.add_argument('-j', '--jobs', type=int, help='Number of worker processes in batch mode (default: all cores)')
+    parser.add_argument('-O', '--optimize', action='store_true',
+                        help='Optimize the netlist: constant propagation, wiring normalization, dead logic removal')
+    parser.add_argument('-b', '--binary', action='store_true',
+                        help='Write the compact binary netlist (see carotte_binary.py) instead of the text one')
+    parser.add_argument('-L', '--levelize', action='count', default=0,
+                        help='Emit the equations by combinational level (REG and RAM contents are sources), '
+                        'use -LL to also write a "# level N" comment before each level of the text netlist')
+    parser.add_argument('--profile', action='store_true',
+                        help='Report the equations created by each function of the circuit on stderr')
+    parser.add_argument('--cache-dir',
+                        help='Reuse the netlists stored in this directory when the circuit sources did not change')
     args = parser.parse_args()
-    process(args.module_file[0], args.output_file)
+    module_files = []
+    for pattern in args.module_file:
+        module_files += sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+    if args.output_dir is None:
+        if len(module_files) != 1:
+            parser.error("processing several circuit files requires --output-dir")
+        process(module_files[0], args.output_file, optimize=args.optimize, cache_dir=args.cache_dir,
+                binary=args.binary, profile=args.profile, levels=args.levelize)
+    else:
+        if args.output_file is not None:
+            parser.error("--output-file and --output-dir are exclusive")
+        if args.profile:
+            parser.error("--profile requires a single circuit file")
+        sys.exit(1 if process_batch(module_files, args.output_dir, optimize=args.optimize, cache_dir=args.cache_dir,
+                                    jobs=args.jobs, binary=args.binary, levels=args.levelize) else 0)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,262 @@
+# SPDX-License-Identifier: CC0-1.0
+# carotte.py by Twal, hbens & more
+
+'''Compact binary form of the netlist built with lib_carotte
+
+All the fields are little-endian unsigned 32 bits integers, in this order:
+- header: magic "CRTN", version, number of INPUT, OUTPUT, equations and strings, size of the string data
+- name and bus size of each variable: the INPUT variables first, then the equations
+- variable id of each OUTPUT
+- equation records: opcode and 6 fields (parameters first, then operand variable ids, then zeros)
+- string offsets (one more than the number of strings), then the UTF-8 string data (padded to 4 bytes)
+
+A variable name is either the index of a string, or `AUTOMATIC_NAME` plus the id of an
+automatic name such as `_l_<id>` (`_input_<id>` for the INPUT variables).
+The value of a constant is the index of a string.
+`BinaryNetlist` memory-maps such a file, and converts it back to the text netlist.
+'''
+
+import array
+import io
+import itertools
+import mmap
+import struct
+import sys
+import typing
+
+import lib_carotte
+from lib_carotte import (RAM, ROM, And, Concat, Constant, EquationVariable,
+                         Input, Mux, Nand, Not, Or, Reg, Select, Slice, Xor)
+
+MAGIC = b"CRTN"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIIII")
+RECORD_FIELDS = 6
+AUTOMATIC_NAME = 1 << 31
+
+# (netlist keyword, equation class, parameter names) of each opcode
+OPCODES: typing.Tuple[typing.Tuple[str, typing.Type[EquationVariable], typing.Tuple[str, ...]], ...] = (
+    ("CONSTANT", Constant, ()),
+    ("NOT", Not, ()),
+    ("REG", Reg, ()),
+    ("AND", And, ()),
+    ("NAND", Nand, ()),
+    ("OR", Or, ()),
+    ("XOR", Xor, ()),
+    ("MUX", Mux, ()),
+    ("ROM", ROM, ('addr_size', 'word_size')),
+    ("RAM", RAM, ('addr_size', 'word_size')),
+    ("CONCAT", Concat, ()),
+    ("SLICE", Slice, ('i1', 'i2')),
+    ("SELECT", Select, ('i',)),
+)
+
+def _little_endian(data: array.array) -> array.array: # type: ignore[type-arg]
+    '''The array with little-endian items'''
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data
+
+def opcode(eq: EquationVariable) -> int:
+    '''Opcode of an equation'''
+    for (k, (_, cls, _)) in enumerate(OPCODES):
+        if isinstance(eq, cls):
+            return k
+    raise ValueError(f"Unknown equation type {type(eq).__name__}")
+
+def write_binary_netlist(f: typing.BinaryIO, levelized: bool = False) -> None:
+    '''Write the netlist of the active circuit in binary form (equations by combinational level if `levelized`)'''
+    # pylint: disable=R0914
+    lib_carotte.resolve_defers()
+    lib_carotte.resolve_names()
+    inputs = lib_carotte.get_inputs()
+    outputs = lib_carotte.get_outputs()
+    equations = lib_carotte.get_equations()
+    if levelized:
+        levels = lib_carotte.combinational_levels(equations)
+        equations = sorted(equations, key=levels.__getitem__)
+    ids = {x: k for (k, x) in enumerate(itertools.chain(inputs, equations))}
+    if len(ids) != len(inputs) + len(equations):
+        raise ValueError("A variable appears twice in the netlist")
+    strings: typing.List[str] = []
+    variables = array.array('I')
+    for (prefix, xs) in ((Input.default_name_prefix, inputs), (EquationVariable.default_name_prefix, equations)):
+        for x in xs:
+            if x.chosen_name is None and x.default_name_prefix == prefix and x.id < AUTOMATIC_NAME:
+                variables.append(AUTOMATIC_NAME | x.id)
+            else:
+                variables.append(len(strings))
+                strings.append(x.name)
+            variables.append(x.bus_size)
+    # Opcode, parameter names and operand names of each equation class
+    layouts: typing.Dict[type, typing.Tuple[int, typing.Tuple[str, ...], typing.Tuple[str, ...]]] = {}
+    padding = [(0,) * (RECORD_FIELDS - k) for k in range(RECORD_FIELDS + 1)]
+    records = array.array('I')
+    for eq in equations:
+        if type(eq) not in layouts:
+            op = opcode(eq)
+            layouts[type(eq)] = (op, OPCODES[op][2], type(eq).operand_names)
+        (op, parameters, operand_names) = layouts[type(eq)]
+        if op == 0:
+            fields = [len(strings)]
+            strings.append(typing.cast(Constant, eq).value)
+        else:
+            try:
+                fields = [getattr(eq, name) for name in parameters] + [ids[getattr(eq, name).get_val()]
+                                                                      for name in operand_names]
+            except KeyError as e:
+                raise ValueError(f"The equation {eq.name} reads a variable that is not in the netlist") from e
+        records.append(op)
+        records.extend(fields)
+        records.extend(padding[len(fields)])
+    data = [s.encode() for s in strings]
+    offsets = array.array('I', itertools.accumulate((len(s) for s in data), initial=0))
+    string_data = b"".join(data)
+    f.write(HEADER.pack(MAGIC, VERSION, len(inputs), len(outputs), len(equations), len(strings), len(string_data)))
+    f.write(_little_endian(variables).tobytes())
+    f.write(_little_endian(array.array('I', (ids[x] for x in outputs))).tobytes())
+    f.write(_little_endian(records).tobytes())
+    f.write(_little_endian(offsets).tobytes())
+    f.write(string_data + b"\0" * (-len(string_data) % 4))
+
+def get_binary_netlist(levelized: bool = False) -> bytes:
+    '''Get the netlist of the active circuit in binary form'''
+    netlist = io.BytesIO()
+    write_binary_netlist(netlist, levelized)
+    return netlist.getvalue()
+
+class BinaryNetlist:
+    '''A binary netlist file, memory-mapped: nothing is read before it is needed'''
+    # pylint: disable=R0902
+    def __init__(self, filename: str):
+        with open(filename, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.views: typing.List[memoryview] = []
+        (magic, version, self.input_count, self.output_count, self.equation_count, string_count,
+         string_size) = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"'{filename}' is not a binary netlist of version {VERSION}")
+        self.variable_count = self.input_count + self.equation_count
+        counts = (2 * self.variable_count, self.output_count, self.equation_count * (1 + RECORD_FIELDS),
+                  string_count + 1)
+        offsets = list(itertools.accumulate((4 * count for count in counts), initial=HEADER.size))
+        (self.variables, self.outputs, self.records, self.string_offsets) = (
+            self.integers(offset, count) for (offset, count) in zip(offsets, counts))
+        self.string_data = self.view(offsets[-1], string_size)
+        if len(self.string_data) != string_size:
+            self.close()
+            raise ValueError(f"'{filename}' is truncated")
+        self.name_cache: typing.Optional[typing.List[str]] = None
+
+    def view(self, offset: int, size: int) -> memoryview:
+        '''Bytes of the file, without copy'''
+        self.views.append(memoryview(self.mmap))
+        self.views.append(self.views[-1][offset:offset + size])
+        return self.views[-1]
+
+    def integers(self, offset: int, count: int) -> typing.Sequence[int]:
+        '''Unsigned 32 bits integers of the file, without copy on little-endian machines'''
+        view = self.view(offset, 4 * count)
+        if sys.byteorder == 'big':
+            data = array.array('I', view)
+            data.byteswap()
+            return data
+        self.views.append(view.cast('I'))
+        return self.views[-1]
+
+    def close(self) -> None:
+        '''Unmap the file'''
+        for view in reversed(self.views):
+            view.release()
+        self.views = []
+        self.mmap.close()
+
+    def __enter__(self) -> 'BinaryNetlist':
+        return self
+
+    def __exit__(self, *exc_info: typing.Any) -> None:
+        self.close()
+
+    def string(self, k: int) -> str:
+        '''The string `k`'''
+        return bytes(self.string_data[self.string_offsets[k]:self.string_offsets[k + 1]]).decode()
+
+    def bus_size(self, k: int) -> int:
+        '''Bus size of the variable `k`'''
+        return self.variables[2 * k + 1]
+
+    def name(self, k: int) -> str:
+        '''Name of the variable `k`'''
+        if self.name_cache is not None:
+            return self.name_cache[k]
+        field = self.variables[2 * k]
+        if field & AUTOMATIC_NAME:
+            prefix = Input.default_name_prefix if k < self.input_count else EquationVariable.default_name_prefix
+            return prefix + str(field ^ AUTOMATIC_NAME)
+        return self.string(field)
+
+    def names(self) -> typing.List[str]:
+        '''Names of all the variables, decoded at once'''
+        if self.name_cache is None:
+            self.name_cache = [self.name(k) for k in range(self.variable_count)]
+        return self.name_cache
+
+    def full_name(self, k: int) -> str:
+        '''Name of the variable `k` for the VAR part of the netlist'''
+        return self.name(k) if self.bus_size(k) == 1 else f"{self.name(k)}:{self.bus_size(k)}"
+
+    def equation(self, k: int) -> typing.Tuple[int, typing.Tuple[int, ...]]:
+        '''Opcode and fields of the equation `k`'''
+        start = k * (1 + RECORD_FIELDS)
+        return (self.records[start], tuple(self.records[start + 1:start + 1 + RECORD_FIELDS]))
+
+    def equation_text(self, k: int) -> str:
+        '''Text form of the equation `k`'''
+        names = self.names()
+        records = self.records
+        start = k * (1 + RECORD_FIELDS)
+        op = records[start]
+        name = names[self.input_count + k]
+        if op == 0:
+            return f"{name} = {self.string(records[start + 1])}"
+        (keyword, cls, parameters) = OPCODES[op]
+        # The common shapes are formatted directly, for speed
+        shape = (len(parameters), len(cls.operand_names))
+        if shape == (0, 1):
+            return f"{name} = {keyword} {names[records[start + 1]]}"
+        if shape == (0, 2):
+            return f"{name} = {keyword} {names[records[start + 1]]} {names[records[start + 2]]}"
+        if shape == (1, 1):
+            return f"{name} = {keyword} {records[start + 1]} {names[records[start + 2]]}"
+        fields = records[start + 1:start + 1 + shape[0] + shape[1]]
+        return " ".join([name, "=", keyword, *map(str, fields[:shape[0]]), *(names[x] for x in fields[shape[0]:])])
+
+    def write_netlist(self, f: typing.TextIO) -> None:
+        '''Write the text netlist, as `lib_carotte.write_netlist` does'''
+        self.names()
+        f.write("INPUT ")
+        lib_carotte.write_chunked(f, (self.name(k) for k in range(self.input_count)), ", ")
+        f.write("\nOUTPUT ")
+        lib_carotte.write_chunked(f, (self.name(k) for k in self.outputs), ", ")
+        f.write("\nVAR ")
+        lib_carotte.write_chunked(f, (self.full_name(k) for k in range(self.variable_count)), ", ")
+        f.write("\nIN\n")
+        lib_carotte.write_chunked(f, (self.equation_text(k) + "\n" for k in range(self.equation_count)), "")
+
+    def get_netlist(self) -> str:
+        '''Get the text netlist'''
+        netlist = io.StringIO()
+        self.write_netlist(netlist)
+        return netlist.getvalue()
+
+def main() -> None:
+    '''Print the text form of the binary netlist given on the command line'''
+    if len(sys.argv) != 2:
+        print(f"Usage: {sys.argv[0]} <binary netlist>", file=sys.stderr)
+        sys.exit(1)
+    with BinaryNetlist(sys.argv[1]) as netlist:
+        netlist.write_netlist(sys.stdout)
+
+if __name__ == "__main__":
+    main()
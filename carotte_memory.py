@@ -0,0 +1,217 @@
+# SPDX-License-Identifier: CC0-1.0
+# carotte.py by Twal, hbens & more
+
+'''Memory model of the simulators: ROM images and RAM contents
+
+ROM images are memory-mapped, and read one word at a time:
+- raw binary: one little-endian word of ceil(word_size / 8) bytes per address
+- hex: one hexadecimal word per line, all lines of the same width
+
+RAM contents are allocated by pages of `PAGE_WORDS` words when first written, so that
+a large memory only costs the pages actually written. The pages of the RAMs can be saved
+to (and loaded from) a NumPy .npz file, e.g. to checkpoint a long simulation.
+'''
+
+import array
+import mmap
+import os
+import sys
+import typing
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None # type: ignore
+
+PAGE_BITS = 10
+PAGE_WORDS = 1 << PAGE_BITS
+# Formats of the machine words of 1, 2, 4 and 8 bytes
+WORD_FORMATS: typing.Dict[int, typing.Literal['B', 'H', 'I', 'Q']] = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
+class HexWords(typing.Sequence[int]):
+    '''Words of a hex image with lines of the same width, decoded when read'''
+    def __init__(self, data: memoryview, stride: int):
+        self.data = data
+        self.stride = stride
+        # The last line may lack its line break
+        self.length = (len(data) + 1) // stride if data[-1:] != b"\n" else len(data) // stride
+
+    def __len__(self) -> int:
+        return self.length
+
+    @typing.overload
+    def __getitem__(self, k: int) -> int: ...
+    @typing.overload
+    def __getitem__(self, k: slice) -> typing.Sequence[int]: ...
+    def __getitem__(self, k: typing.Union[int, slice]) -> typing.Union[int, typing.Sequence[int]]:
+        if isinstance(k, slice):
+            return [self[i] for i in range(*k.indices(self.length))]
+        if not 0 <= k < self.length:
+            raise IndexError(k)
+        line = bytes(self.data[k * self.stride:(k + 1) * self.stride])
+        if len(line) == self.stride and line[-1:] != b"\n":
+            raise ValueError(f"The line {k + 1} of the hex ROM image does not have the width of the first line")
+        return int(line, 16)
+
+class RawWords(typing.Sequence[int]):
+    '''Words of a raw binary image whose size is not 1, 2, 4 or 8 bytes'''
+    def __init__(self, data: memoryview, word_bytes: int):
+        self.data = data
+        self.word_bytes = word_bytes
+
+    def __len__(self) -> int:
+        return len(self.data) // self.word_bytes
+
+    @typing.overload
+    def __getitem__(self, k: int) -> int: ...
+    @typing.overload
+    def __getitem__(self, k: slice) -> typing.Sequence[int]: ...
+    def __getitem__(self, k: typing.Union[int, slice]) -> typing.Union[int, typing.Sequence[int]]:
+        if isinstance(k, slice):
+            return [self[i] for i in range(*k.indices(len(self)))]
+        if not 0 <= k < len(self):
+            raise IndexError(k)
+        return int.from_bytes(self.data[k * self.word_bytes:(k + 1) * self.word_bytes], 'little')
+
+class RomImage(typing.Sequence[int]):
+    '''Memory-mapped ROM image, in raw binary or hex (guessed from the .hex extension when `hex_format` is None)
+
+    `words` is the fastest sequence of the words of the image, used directly by the simulators.'''
+    def __init__(self, filename: str, word_size: int, hex_format: typing.Optional[bool] = None):
+        if hex_format is None:
+            hex_format = os.path.splitext(filename)[1].lower() == ".hex"
+        (self.filename, self.hex_format) = (filename, hex_format)
+        self.word_size = word_size
+        self.word_bytes = (word_size + 7) // 8
+        self.views: typing.List[memoryview] = []
+        with open(filename, 'rb') as f:
+            # Empty files cannot be mapped
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else None
+        self.words: typing.Sequence[int]
+        data = self.view(memoryview(self.mmap if self.mmap is not None else b""))
+        if hex_format:
+            stride = bytes(data[:4096]).find(b"\n") + 1
+            self.words = HexWords(data, stride) if stride > 0 else [int(bytes(data), 16)] if len(data) else []
+        elif self.word_bytes in WORD_FORMATS and sys.byteorder == 'little':
+            whole = len(data) - len(data) % self.word_bytes
+            self.words = self.view(self.view(data[:whole]).cast(WORD_FORMATS[self.word_bytes]))
+        else:
+            self.words = RawWords(data, self.word_bytes)
+
+    def view(self, view: memoryview) -> memoryview:
+        '''Keep track of a view of the image, to release it on close'''
+        self.views.append(view)
+        return view
+
+    def close(self) -> None:
+        '''Release the image'''
+        for view in reversed(self.views):
+            view.release()
+        self.views.clear()
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
+    def __reduce__(self) -> typing.Tuple[type, typing.Tuple[str, int, bool]]:
+        # Pickled by file name: the image is mapped again, e.g. by the worker processes of a ParallelSimulator
+        return (RomImage, (self.filename, self.word_size, self.hex_format))
+
+    def __enter__(self) -> 'RomImage':
+        return self
+
+    def __exit__(self, *exc_info: typing.Any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    @typing.overload
+    def __getitem__(self, k: int) -> int: ...
+    @typing.overload
+    def __getitem__(self, k: slice) -> typing.Sequence[int]: ...
+    def __getitem__(self, k: typing.Union[int, slice]) -> typing.Union[int, typing.Sequence[int]]:
+        return self.words[k]
+
+    def numpy(self) -> 'np.ndarray':
+        '''The words as a NumPy array, without copying raw images of 1, 2, 4 or 8 byte words'''
+        if isinstance(self.words, memoryview):
+            return np.frombuffer(self.words, dtype=f"<u{self.word_bytes}")
+        if self.word_size > 64:
+            raise ValueError("ROM words wider than 64 bits cannot be converted to a NumPy array")
+        return np.fromiter(self.words, dtype=np.uint64, count=len(self.words))
+
+class PagedMemory:
+    '''RAM contents, allocated by pages of PAGE_WORDS words when first written
+
+    Reads and writes use the integer address, like a dict of the written words.'''
+    def __init__(self, word_size: int):
+        self.word_size = word_size
+        # Typecode of the smallest machine words holding a RAM word, None for python integers
+        self.typecode = next((typecode for (size, typecode) in WORD_FORMATS.items()
+                              if word_size <= 8 * size and array.array(typecode).itemsize == size), None)
+        self.pages: typing.Dict[int, typing.MutableSequence[int]] = {}
+        # Read-only page of the addresses never written
+        self.zero_page = self.new_page()
+
+    def new_page(self) -> typing.MutableSequence[int]:
+        '''A page of zeros'''
+        if self.typecode is None:
+            return [0] * PAGE_WORDS
+        return array.array(self.typecode, bytes(array.array(self.typecode).itemsize * PAGE_WORDS))
+
+    def get(self, addr: int, default: int = 0) -> int:
+        '''The word at `addr`, or `default` if its page was never written'''
+        page = self.pages.get(addr >> PAGE_BITS)
+        return default if page is None else page[addr & (PAGE_WORDS - 1)]
+
+    def __getitem__(self, addr: int) -> int:
+        return self.pages.get(addr >> PAGE_BITS, self.zero_page)[addr & (PAGE_WORDS - 1)]
+
+    def __setitem__(self, addr: int, value: int) -> None:
+        page = self.pages.get(addr >> PAGE_BITS)
+        if page is None:
+            page = self.pages[addr >> PAGE_BITS] = self.new_page()
+        page[addr & (PAGE_WORDS - 1)] = value
+
+    def allocated_bytes(self) -> int:
+        '''Size of the allocated pages'''
+        return sum(sys.getsizeof(page) for page in self.pages.values())
+
+    def arrays(self) -> typing.Tuple['np.ndarray', 'np.ndarray']:
+        '''(page numbers, pages) of the allocated pages, as NumPy arrays'''
+        if self.typecode is None:
+            raise ValueError("RAM words wider than 64 bits cannot be converted to NumPy arrays")
+        numbers = np.array(sorted(self.pages), dtype=np.uint64)
+        data = np.empty((len(numbers), PAGE_WORDS), dtype=np.uint64)
+        for (k, number) in enumerate(numbers.tolist()):
+            data[k] = np.array(self.pages[number], dtype=np.uint64)
+        return (numbers, data)
+
+    def set_arrays(self, numbers: 'np.ndarray', data: 'np.ndarray') -> None:
+        '''Replace the contents by the pages given by `arrays`'''
+        self.pages.clear()
+        if self.typecode is None:
+            raise ValueError("RAM words wider than 64 bits cannot be converted from NumPy arrays")
+        itemsize = array.array(self.typecode).itemsize
+        for (number, page) in zip(numbers.tolist(), data):
+            self.pages[number] = array.array(self.typecode, page.astype(f"u{itemsize}").tobytes())
+
+def save_memories(filename: str, memories: typing.Mapping[str, PagedMemory]) -> None:
+    '''Save the pages of named memories to a NumPy .npz file'''
+    if np is None:
+        raise RuntimeError("Install module 'numpy' to save the memories")
+    arrays: typing.Dict[str, typing.Any] = {}
+    for (name, memory) in memories.items():
+        (arrays[f"{name}.pages"], arrays[f"{name}.data"]) = memory.arrays()
+    with open(filename, 'wb') as f:
+        np.savez(f, **arrays)
+
+def load_memories(filename: str, memories: typing.Mapping[str, PagedMemory]) -> None:
+    '''Load the pages of named memories saved by `save_memories`'''
+    if np is None:
+        raise RuntimeError("Install module 'numpy' to load the memories")
+    with np.load(filename) as arrays:
+        for (name, memory) in memories.items():
+            if f"{name}.pages" not in arrays:
+                raise ValueError(f"The file '{filename}' has no contents for the memory '{name}'")
+            memory.set_arrays(arrays[f"{name}.pages"], arrays[f"{name}.data"])
@@ -0,0 +1,467 @@
+# SPDX-License-Identifier: CC0-1.0
+# carotte.py by Twal, hbens & more
+
+'''Optimization passes on the netlist built with lib_carotte
+
+The passes keep the INPUT and OUTPUT names, and run once all Defer nodes are evaluated.
+'''
+
+import heapq
+import typing
+
+import carotte_sim
+import lib_carotte
+from lib_carotte import (RAM, ROM, And, Binop, Concat, Constant,
+                         EquationVariable, Mux, Nand, Not, Or, Reg, Select,
+                         Slice, Unop, Variable, Xor)
+
+Replacements = typing.Dict[Variable, Variable]
+Rule = typing.Callable[[EquationVariable], typing.Optional[Variable]]
+
+def substitute_operands(eq: EquationVariable, replacements: Replacements) -> None:
+    '''Point the operands of `eq` to their replacements (this also drops the Defer operands)'''
+    for name in eq.operand_names:
+        x = getattr(eq, name).get_val()
+        setattr(eq, name, replacements.get(x, x))
+
+def make_constant(value: int, bus_size: int) -> Variable:
+    '''New netlist constant'''
+    return Constant(carotte_sim.bus_to_string(value, bus_size))
+
+def fold(eq: EquationVariable) -> typing.Optional[Variable]:
+    '''Simpler variable equivalent to `eq`, if any'''
+    # pylint: disable=R0911,R0912
+    if isinstance(eq, (Constant, ROM, RAM)):
+        return None
+    operands = eq.get_operands()
+    values: carotte_sim.Values = {x: carotte_sim.constant_value(x.value) for x in operands if isinstance(x, Constant)}
+    full = carotte_sim.mask(eq.bus_size)
+    if isinstance(eq, Reg):
+        # Registers start at 0
+        return operands[0] if values.get(operands[0]) == 0 else None
+    if all(x in values for x in operands):
+        return make_constant(carotte_sim.evaluate(eq, values, {}, {}), eq.bus_size)
+    if isinstance(eq, Not):
+        return eq.x.x.get_val() if isinstance(eq.x, Not) else None
+    if isinstance(eq, Mux):
+        if eq.choice in values:
+            return eq.b.get_val() if values[eq.choice] else eq.a.get_val()
+        return eq.a.get_val() if eq.a.get_val() is eq.b.get_val() else None
+    if not isinstance(eq, Binop):
+        return None
+    (lhs, rhs) = operands
+    if lhs is rhs:
+        if isinstance(eq, (And, Or)):
+            return lhs
+        return make_constant(0, eq.bus_size) if isinstance(eq, Xor) else Not(lhs)
+    if rhs in values:
+        (x, value) = (lhs, values[rhs])
+    elif lhs in values:
+        (x, value) = (rhs, values[lhs])
+    else:
+        return None
+    if value not in (0, full):
+        return None
+    if isinstance(eq, And):
+        return x if value == full else make_constant(0, eq.bus_size)
+    if isinstance(eq, Or):
+        return make_constant(full, eq.bus_size) if value == full else x
+    if isinstance(eq, Xor):
+        return Not(x) if value == full else x
+    if isinstance(eq, Nand):
+        return Not(x) if value == full else make_constant(full, eq.bus_size)
+    return None
+
+def rename_outputs(replacements: Replacements) -> None:
+    '''Make the OUTPUT names refer to the replacements of the replaced outputs'''
+    outputs = lib_carotte.get_outputs()
+    output_set = set(outputs)
+    for (k, output) in enumerate(outputs):
+        if output not in replacements:
+            continue
+        name = output.name
+        output.rename("_" + name + "_" + str(lib_carotte.get_and_increment_equation_counter()), True)
+        new_output = replacements[output]
+        while new_output in replacements:
+            new_output = replacements[new_output]
+        if not isinstance(new_output, EquationVariable) or new_output in output_set:
+            # Inputs and other outputs keep their name: use a copy
+            new_output = Slice(0, new_output.bus_size, new_output)
+        new_output.rename(name)
+        outputs[k] = new_output
+        output_set.add(new_output)
+    circuit_outputs = lib_carotte.current_circuit().output_set
+    circuit_outputs.clear()
+    circuit_outputs.update(outputs)
+
+def rewrite(rule: Rule) -> None:
+    '''Replace every equation by the result of `rule`, when it is not None'''
+    circuit = lib_carotte.current_circuit()
+    ribbon = circuit.allow_ribbon_logic_operations
+    # The replacement of a bus-wide gate is bus-wide, even if ribbon logic operations were disabled since
+    circuit.allow_ribbon_logic_operations = True
+    try:
+        lib_carotte.resolve_defers()
+        equations = lib_carotte.get_equations()
+        replacements: Replacements = {}
+        # New equations are put just before the equation that created them
+        positions = {eq: (k, 1, 0) for (k, eq) in enumerate(equations)}
+        changed = True
+        while changed:
+            changed = False
+            # REG operands are not scheduled before the REG: the pass is repeated until nothing changes
+            for eq in lib_carotte.schedule(equations):
+                substitute_operands(eq, replacements)
+                if eq in replacements:
+                    continue
+                old_len = len(equations)
+                new = rule(eq)
+                for new_eq in equations[old_len:]:
+                    positions[new_eq] = (positions[eq][0], 0, len(positions))
+                if new is not None:
+                    replacements[eq] = new
+                    changed = True
+            for eq in equations:
+                substitute_operands(eq, replacements)
+        rename_outputs(replacements)
+        lib_carotte.set_equations(sorted((eq for eq in equations if eq not in replacements),
+                                         key=lambda eq: positions.get(eq, (len(equations), 1, 0))))
+    finally:
+        circuit.allow_ribbon_logic_operations = ribbon
+
+def fold_constants() -> None:
+    '''Propagate the constants and simplify the gates with a constant or duplicated operand'''
+    rewrite(fold)
+
+def wire(x: Variable, i1: int, i2: int) -> typing.Optional[Variable]:
+    '''Select the bits i1 to i2 (included) of `x` by looking through SELECT, SLICE and CONCAT
+
+    Returns None when the result would be the same as `x[i1:i2+1]`'''
+    (source, j1, j2) = (x, i1, i2)
+    while True:
+        if isinstance(source, Slice):
+            (j1, j2) = (j1 + source.i1, j2 + source.i1)
+            source = source.x.get_val()
+        elif isinstance(source, Select):
+            (j1, j2) = (source.i, source.i)
+            source = source.x.get_val()
+        elif isinstance(source, Concat) and j2 < source.lhs.bus_size:
+            source = source.lhs.get_val()
+        elif isinstance(source, Concat) and j1 >= source.lhs.bus_size:
+            (j1, j2) = (j1 - source.lhs.bus_size, j2 - source.lhs.bus_size)
+            source = source.rhs.get_val()
+        else:
+            break
+    if (j1, j2) == (0, source.bus_size - 1):
+        return source
+    if source is x:
+        return None
+    return Select(j1, source) if j1 == j2 else Slice(j1, j2 + 1, source)
+
+def bits(x: Variable, i1: int, i2: int) -> Variable:
+    '''The bits i1 to i2 (included) of `x`'''
+    return wire(x, i1, i2) or (Select(i1, x) if i1 == i2 else Slice(i1, i2 + 1, x))
+
+def simplify_wiring(eq: EquationVariable) -> typing.Optional[Variable]:
+    '''Select and slice through SELECT, SLICE and CONCAT, and drop the identity selections'''
+    if isinstance(eq, Select):
+        return wire(eq.x.get_val(), eq.i, eq.i)
+    if isinstance(eq, Slice):
+        return wire(eq.x.get_val(), eq.i1, eq.i2)
+    return None
+
+def wire_range(x: Variable) -> typing.Tuple[Variable, int, int]:
+    '''(source, i1, i2) such that `x` is the bits i1 to i2 (included) of source'''
+    if isinstance(x, Select):
+        return (x.x.get_val(), x.i, x.i)
+    if isinstance(x, Slice):
+        return (x.x.get_val(), x.i1, x.i2)
+    return (x, 0, x.bus_size - 1)
+
+def concat_tree(nodes: typing.List[Variable]) -> typing.List[Variable]:
+    '''Pair the nodes (bit 0 first) into a balanced tree of CONCAT, until at most two remain'''
+    while len(nodes) > 2:
+        nodes = [Concat(nodes[k], nodes[k + 1]) if k + 1 < len(nodes) else nodes[k]
+                 for k in range(0, len(nodes), 2)]
+    return nodes
+
+class ConcatBalancer:
+    '''Rewrite rule turning chains of CONCAT into balanced trees of CONCAT
+
+    The CONCAT read only by another CONCAT are part of the chain of that CONCAT.
+    Contiguous parts of a same variable are merged.'''
+    def __init__(self) -> None:
+        lib_carotte.resolve_defers()
+        self.outputs = set(lib_carotte.get_outputs())
+        self.readers: typing.Dict[Variable, typing.List[EquationVariable]] = {}
+        for eq in lib_carotte.get_equations():
+            for x in eq.get_operands():
+                self.readers.setdefault(x, []).append(eq)
+
+    def in_chain(self, x: Variable) -> bool:
+        '''Is `x` a CONCAT only read by a CONCAT'''
+        readers = self.readers.get(x, [])
+        return (isinstance(x, Concat) and x not in self.outputs and len(readers) == 1
+                and isinstance(readers[0], Concat))
+
+    def __call__(self, eq: EquationVariable) -> typing.Optional[Variable]:
+        if not isinstance(eq, Concat) or self.in_chain(eq):
+            return None
+        # Parts of the chain, from bit 0 to the last bit: (source, i1, i2, original variable if not merged)
+        parts: typing.List[typing.Tuple[Variable, int, int, typing.Optional[Variable]]] = []
+        depth = 0
+        stack = [(eq.rhs.get_val(), 1), (eq.lhs.get_val(), 1)]
+        while stack:
+            (x, x_depth) = stack.pop()
+            if self.in_chain(x):
+                assert isinstance(x, Concat)
+                stack += [(x.rhs.get_val(), x_depth + 1), (x.lhs.get_val(), x_depth + 1)]
+                continue
+            depth = max(depth, x_depth)
+            (source, i1, i2) = wire_range(x)
+            if parts and parts[-1][0] is source and parts[-1][2] + 1 == i1:
+                parts[-1] = (source, parts[-1][1], i2, None)
+            else:
+                parts.append((source, i1, i2, x))
+        nodes = [x if x is not None else bits(source, i1, i2) for (source, i1, i2, x) in parts]
+        if len(nodes) == 1:
+            return nodes[0]
+        if depth <= (len(nodes) - 1).bit_length() and all(x is not None for (_, _, _, x) in parts):
+            return None
+        (eq.lhs, eq.rhs) = concat_tree(nodes)
+        return None
+
+    def leaves(self, eq: Concat) -> typing.List[Variable]:
+        '''Parts of the chain of `eq`, from bit 0 to the last bit'''
+        leaves = []
+        stack = [eq.rhs.get_val(), eq.lhs.get_val()]
+        while stack:
+            x = stack.pop()
+            if self.in_chain(x):
+                assert isinstance(x, Concat)
+                stack += [x.rhs.get_val(), x.lhs.get_val()]
+            else:
+                leaves.append(x)
+        return leaves
+
+class RibbonPacker(ConcatBalancer):
+    '''Rewrite rule turning the CONCAT of per-bit gates into bus-wide gates
+
+    A run of one-bit parts of a CONCAT chain is packed when the parts are the same gate (with the
+    same choice for MUX), read only by the chain, whose operands can themselves be packed:
+    consecutive bits of a same variable, constants, or such gates again.
+    NOT, REG and the binary gates are only packed when ribbon logic operations are allowed.'''
+    def __init__(self) -> None:
+        super().__init__()
+        self.ribbon = lib_carotte.current_circuit().allow_ribbon_logic_operations
+        # Gates replaced by a bus-wide gate
+        self.packed: typing.Set[Variable] = set()
+
+    def signature(self, x: Variable) -> typing.Optional[typing.Tuple[typing.Any, ...]]:
+        '''Gates with the same signature (not None) may be packed together'''
+        if x.bus_size != 1 or x in self.outputs or len(self.readers.get(x, [])) != 1:
+            return None
+        if isinstance(x, Constant):
+            return (Constant,)
+        if isinstance(x, Mux):
+            return (Mux, x.choice.get_val())
+        if isinstance(x, (Unop, Binop)) and self.ribbon:
+            return (type(x),)
+        return None
+
+    def packed_operands(self, eq: Variable) -> typing.List[str]:
+        '''Operands of the gate `eq` that are packed too'''
+        assert isinstance(eq, EquationVariable)
+        return [name for name in eq.operand_names if not (isinstance(eq, Mux) and name == 'choice')]
+
+    def packable(self, xs: typing.Sequence[Variable]) -> bool:
+        '''Is there a bus whose bit k is xs[k], without the gates of `xs`'''
+        ranges = [wire_range(x) for x in xs]
+        (source, i1, _) = ranges[0]
+        if all(r == (source, i1 + k, i1 + k) for (k, r) in enumerate(ranges)):
+            return True
+        signature = self.signature(xs[0])
+        if signature is None or any(self.signature(x) != signature for x in xs[1:]):
+            return False
+        return all(self.packable([getattr(x, name).get_val() for x in xs]) for name in self.packed_operands(xs[0]))
+
+    def pack(self, xs: typing.Sequence[Variable]) -> Variable:
+        '''The bus whose bit k is xs[k], once `packable(xs)` holds'''
+        (source, i1, _) = wire_range(xs[0])
+        if all(wire_range(x) == (source, i1 + k, i1 + k) for (k, x) in enumerate(xs)):
+            return bits(source, i1, i1 + len(xs) - 1)
+        self.packed.update(xs)
+        if isinstance(xs[0], Constant):
+            return Constant("".join(typing.cast(Constant, x).value for x in xs))
+        operands = {name: self.pack([getattr(x, name).get_val() for x in xs]) for name in self.packed_operands(xs[0])}
+        if isinstance(xs[0], Mux):
+            return Mux(xs[0].choice.get_val(), operands['a'], operands['b'])
+        return typing.cast(typing.Callable[..., Variable], type(xs[0]))(*operands.values())
+
+    def __call__(self, eq: EquationVariable) -> typing.Optional[Variable]:
+        if not isinstance(eq, Concat) or self.in_chain(eq):
+            return None
+        leaves = self.leaves(eq)
+        parts: typing.List[Variable] = []
+        k = 0
+        while k < len(leaves):
+            signature = self.signature(leaves[k])
+            end = k + 1
+            while signature is not None and end < len(leaves) and self.signature(leaves[end]) == signature:
+                end += 1
+            # The prefixes of a packable run are packable: binary search for the longest one
+            while k < end:
+                (low, high) = (k + 1, end)
+                while low < high:
+                    middle = (low + high + 1) // 2
+                    (low, high) = (middle, high) if self.packable(leaves[k:middle]) else (low, middle - 1)
+                parts.append(self.pack(leaves[k:low]) if low - k > 1 else leaves[k])
+                k = low
+        if len(parts) == len(leaves):
+            return None
+        if len(parts) == 1:
+            return parts[0]
+        (eq.lhs, eq.rhs) = concat_tree(parts)
+        return None
+
+def remove_unread(removable: typing.Callable[[Variable], bool]) -> None:
+    '''Remove the equations accepted by `removable` that are neither read nor OUTPUT'''
+    equations = lib_carotte.get_equations()
+    readers = dict.fromkeys(lib_carotte.get_outputs(), 1)
+    for eq in equations:
+        for x in eq.get_operands():
+            readers[x] = readers.get(x, 0) + 1
+    dead = set()
+    stack = [eq for eq in equations if removable(eq) and eq not in readers]
+    while stack:
+        eq = stack.pop()
+        dead.add(eq)
+        for x in eq.get_operands():
+            readers[x] -= 1
+            if readers[x] == 0 and isinstance(x, EquationVariable) and removable(x):
+                stack.append(x)
+    lib_carotte.set_equations([eq for eq in equations if eq not in dead])
+
+def remove_dead_wiring() -> None:
+    '''Remove the SELECT, SLICE and CONCAT that are neither read nor OUTPUT'''
+    remove_unread(lambda x: isinstance(x, (Select, Slice, Concat)))
+
+def normalize_wiring() -> None:
+    '''Simplify the SELECT, SLICE and CONCAT, and balance the CONCAT chains'''
+    rewrite(simplify_wiring)
+    remove_dead_wiring()
+    rewrite(ConcatBalancer())
+    remove_dead_wiring()
+
+def gate_delay(eq: EquationVariable) -> int:
+    '''Logic depth added by `eq`: the wiring, constants and REG outputs add none'''
+    return 0 if isinstance(eq, (Select, Slice, Concat, Constant, Reg)) else 1
+
+def logic_depths() -> typing.Dict[Variable, int]:
+    '''Number of gates on the longest combinational path ending at each equation'''
+    lib_carotte.resolve_defers()
+    depths: typing.Dict[Variable, int] = {}
+    for eq in lib_carotte.schedule(lib_carotte.get_equations()):
+        depths[eq] = gate_delay(eq) + max((depths.get(x, 0) for x in lib_carotte.combinational_operands(eq)), default=0)
+    return depths
+
+def logic_depth() -> int:
+    '''Number of gates on the longest combinational path of the netlist'''
+    return max(logic_depths().values(), default=0)
+
+class GateBalancer:
+    '''Rewrite rule turning chains of AND, OR or XOR into trees of minimal logic depth
+
+    The gates read only by a gate of the same operator are part of the chain of that gate.
+    The operands of a chain are combined shallowest first, so late operands cross the fewest gates.'''
+    def __init__(self) -> None:
+        lib_carotte.resolve_defers()
+        self.outputs = set(lib_carotte.get_outputs())
+        self.readers: typing.Dict[Variable, typing.List[EquationVariable]] = {}
+        for eq in lib_carotte.get_equations():
+            for x in eq.get_operands():
+                self.readers.setdefault(x, []).append(eq)
+        # Equations are visited after the equations they combinationally read
+        self.depths: typing.Dict[Variable, int] = {}
+        # Former members of the rebuilt chains
+        self.absorbed: typing.Set[Variable] = set()
+
+    def in_chain(self, x: Variable) -> bool:
+        '''Is `x` an AND, OR or XOR only read by a gate of the same operator'''
+        readers = self.readers.get(x, [])
+        return (isinstance(x, (And, Or, Xor)) and x not in self.outputs and len(readers) == 1
+                and type(readers[0]) is type(x))
+
+    def depth(self, x: Variable) -> int:
+        '''Logic depth of a variable already visited (inputs and REG outputs have depth 0)'''
+        return self.depths.get(x, 0)
+
+    def __call__(self, eq: EquationVariable) -> typing.Optional[Variable]:
+        if not isinstance(eq, (And, Or, Xor)) or self.in_chain(eq):
+            self.depths[eq] = gate_delay(eq) + max(map(self.depth, lib_carotte.combinational_operands(eq)),
+                                                   default=0)
+            return None
+        (nodes, chain) = ([], [])
+        stack = [eq.rhs.get_val(), eq.lhs.get_val()]
+        while stack:
+            x = stack.pop()
+            if self.in_chain(x):
+                assert isinstance(x, Binop)
+                chain.append(x)
+                stack += [x.rhs.get_val(), x.lhs.get_val()]
+            else:
+                nodes.append(x)
+        old_depth = 1 + max(self.depth(eq.lhs.get_val()), self.depth(eq.rhs.get_val()))
+        # Huffman-like merge of the two shallowest nodes; the index keeps the result deterministic
+        heap = [(self.depth(x), k) for (k, x) in enumerate(nodes)]
+        heapq.heapify(heap)
+        merges = []
+        while len(heap) > 1:
+            ((lhs_depth, lhs), (rhs_depth, rhs)) = (heapq.heappop(heap), heapq.heappop(heap))
+            merges.append((lhs, rhs))
+            heapq.heappush(heap, (1 + max(lhs_depth, rhs_depth), len(nodes) + len(merges) - 1))
+        self.depths[eq] = min(old_depth, heap[0][0])
+        if heap[0][0] >= old_depth:
+            return None
+        for (lhs, rhs) in merges[:-1]:
+            nodes.append(type(eq)(nodes[lhs], nodes[rhs]))
+            self.depths[nodes[-1]] = 1 + max(self.depth(nodes[lhs]), self.depth(nodes[rhs]))
+        (eq.lhs, eq.rhs) = (nodes[merges[-1][0]], nodes[merges[-1][1]])
+        self.absorbed.update(chain)
+        return None
+
+def balance_logic() -> None:
+    '''Rebuild the chains of AND, OR and XOR as balanced trees, to reduce the logic depth'''
+    balancer = GateBalancer()
+    rewrite(balancer)
+    remove_unread(lambda x: x in balancer.absorbed)
+
+def pack_ribbons() -> None:
+    '''Replace the CONCAT of per-bit gates by bus-wide gates, see `RibbonPacker`'''
+    packer = RibbonPacker()
+    rewrite(packer)
+    remove_unread(lambda x: x in packer.packed or isinstance(x, (Select, Slice, Concat)))
+
+def remove_dead_equations() -> None:
+    '''Remove the equations that do not influence an OUTPUT, a REG or a RAM'''
+    lib_carotte.resolve_defers()
+    equations = lib_carotte.get_equations()
+    live = set()
+    stack = list(lib_carotte.get_outputs()) + [eq for eq in equations if isinstance(eq, (Reg, RAM))]
+    while stack:
+        x = stack.pop()
+        if x not in live:
+            live.add(x)
+            if isinstance(x, EquationVariable):
+                stack += x.get_operands()
+    lib_carotte.set_equations([eq for eq in equations if eq in live])
+
+def optimize() -> typing.Tuple[int, int]:
+    '''Run all the optimization passes; returns the logic depth before and after'''
+    depth = logic_depth()
+    fold_constants()
+    pack_ribbons()
+    normalize_wiring()
+    balance_logic()
+    remove_dead_equations()
+    return (depth, logic_depth())
@@ -0,0 +1,146 @@
+# SPDX-License-Identifier: CC0-1.0
+# carotte.py by Twal, hbens & more
+
+'''Parser of the text netlists written by lib_carotte
+
+The netlist is read line by line and rebuilt in the active circuit, with the same
+variable names, so that `lib_carotte.get_netlist()` then gives back the same text.
+Operands defined after the equation reading them (e.g. REG loops) are Defer nodes.
+Comments start with `#` and run until the end of the line.
+'''
+
+import itertools
+import typing
+
+import lib_carotte
+from lib_carotte import (RAM, ROM, And, Concat, Constant, Defer, Input, Mux,
+                         Nand, Not, Or, Reg, Select, Slice, Variable,
+                         VariableOrDefer, Xor)
+
+UNOPS = {"NOT": Not, "REG": Reg}
+BINOPS = {"AND": And, "NAND": Nand, "OR": Or, "XOR": Xor, "CONCAT": Concat}
+
+class NetlistParser:
+    '''Rebuilds a netlist in the active circuit, one line at a time'''
+    def __init__(self) -> None:
+        self.variables: typing.Dict[str, Variable] = {}
+        self.forward_references: typing.Dict[str, Defer] = {}
+        self.bus_sizes: typing.Dict[str, int] = {}
+        self.line_number = 0
+
+    def error(self, message: str) -> ValueError:
+        '''Parse error at the current line'''
+        return ValueError(f"Netlist line {self.line_number}: {message}")
+
+    def operand(self, name: str) -> VariableOrDefer:
+        '''The variable called `name`, or a Defer node if it is not defined yet'''
+        x = self.variables.get(name)
+        if x is not None:
+            return x
+        if name not in self.forward_references:
+            if name not in self.bus_sizes:
+                raise self.error(f"the variable '{name}' is not declared")
+            variables = self.variables
+            self.forward_references[name] = Defer(self.bus_sizes[name], lambda: variables[name])
+        return self.forward_references[name]
+
+    def header(self, text: str) -> typing.Tuple[typing.List[str], typing.List[str]]:
+        '''Parse the INPUT, OUTPUT and VAR parts; returns the INPUT and OUTPUT names'''
+        parts = text.split()
+        keywords = [k for (k, x) in enumerate(parts) if x in ("INPUT", "OUTPUT", "VAR")]
+        if [parts[k] for k in keywords] != ["INPUT", "OUTPUT", "VAR"]:
+            raise self.error("expected the INPUT, OUTPUT and VAR parts before IN")
+        (inputs, outputs, variables) = (" ".join(parts[k + 1:end]).replace(",", " ").split()
+                                        for (k, end) in zip(keywords, keywords[1:] + [len(parts)]))
+        for x in variables:
+            (name, _, size) = x.partition(":")
+            self.bus_sizes[name] = int(size) if size else 1
+        return (inputs, outputs)
+
+    def equation(self, line: str) -> None:
+        '''Parse an equation line'''
+        # pylint: disable=R0912
+        tokens = line.split()
+        if len(tokens) < 3 or tokens[1] != "=":
+            raise self.error(f"invalid equation '{line}'")
+        (name, _, op, *args) = tokens
+        operand = self.operand
+        eq: Variable
+        if op in BINOPS and len(args) == 2:
+            eq = BINOPS[op](operand(args[0]), operand(args[1]))
+        elif op in UNOPS and len(args) == 1:
+            eq = UNOPS[op](operand(args[0]))
+        elif op == "MUX" and len(args) == 3:
+            eq = Mux(operand(args[0]), operand(args[1]), operand(args[2]))
+        elif op == "SELECT" and len(args) == 2:
+            eq = Select(int(args[0]), operand(args[1]))
+        elif op == "SLICE" and len(args) == 3:
+            eq = Slice(int(args[0]), int(args[1]) + 1, operand(args[2]))
+        elif op == "ROM" and len(args) == 3:
+            eq = ROM(int(args[0]), int(args[1]), operand(args[2]))
+        elif op == "RAM" and len(args) == 6:
+            eq = RAM(int(args[0]), int(args[1]), *(operand(x) for x in args[2:]))
+        elif not args:
+            eq = Constant(op)
+        else:
+            raise self.error(f"invalid equation '{line}'")
+        if name in self.variables:
+            raise self.error(f"the variable '{name}' is defined twice")
+        if self.bus_sizes.get(name) != eq.bus_size:
+            raise self.error(f"the variable '{name}' is declared with another bus size")
+        # Automatic names until the end of the parsing, so that no SELECT or SLICE takes the name of another variable
+        eq.rename(name, True)
+        self.variables[name] = eq
+
+    def parse(self, lines: typing.Iterable[str]) -> None:
+        '''Parse the netlist lines'''
+        # pylint: disable=R0912
+        header: typing.List[str] = []
+        outputs: typing.List[str] = []
+        in_equations = False
+        for line in lines:
+            self.line_number += 1
+            line = line.partition("#")[0].strip()
+            if not line:
+                continue
+            if in_equations:
+                self.equation(line)
+            elif line == "IN":
+                (inputs, outputs) = self.header(" ".join(header))
+                header = []
+                for name in inputs:
+                    if name not in self.bus_sizes:
+                        raise self.error(f"the INPUT '{name}' is not declared")
+                    self.variables[name] = Input(self.bus_sizes[name], name)
+                    self.variables[name].autogen_name = True
+                in_equations = True
+            else:
+                header.append(line)
+        if not in_equations:
+            raise self.error("missing IN")
+        for name in self.bus_sizes:
+            if name not in self.variables:
+                raise self.error(f"the variable '{name}' is declared but not defined")
+        lib_carotte.resolve_defers()
+        for variable in itertools.chain(lib_carotte.get_inputs(), lib_carotte.get_equations()):
+            variable.autogen_name = False
+        for name in outputs:
+            if name not in self.variables:
+                raise self.error(f"the OUTPUT '{name}' is not defined")
+            self.variables[name].set_as_output()
+
+def read_netlist(lines: typing.Iterable[str]) -> None:
+    '''Rebuild the netlist read from a text file (or any iterable of lines) in the active circuit'''
+    circuit = lib_carotte.current_circuit()
+    options = (circuit.allow_ribbon_logic_operations, circuit.hash_consing)
+    # The netlist may contain ribbon logic operations, and must be rebuilt as is
+    (circuit.allow_ribbon_logic_operations, circuit.hash_consing) = (True, False)
+    try:
+        NetlistParser().parse(lines)
+    finally:
+        (circuit.allow_ribbon_logic_operations, circuit.hash_consing) = options
+
+def load_netlist(filename: str) -> None:
+    '''Rebuild the netlist of a text file in the active circuit'''
+    with open(filename, 'r', encoding='utf-8') as f:
+        read_netlist(f)
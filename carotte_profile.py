@@ -0,0 +1,153 @@
+# SPDX-License-Identifier: CC0-1.0
+# carotte.py by Twal, hbens & more
+
+'''Attribution of the netlist equations to the python functions that built them
+
+While a `Profiler` is active, each new equation records the call stack of the circuit code
+creating it (the frames of lib_carotte are left out), as a tuple of (code, line) pairs.
+The elaboration time between two new equations is charged to the call stack of the second one.
+The report aggregates the equations by function: a flat view of the functions creating them,
+and a tree view of the call paths where each function includes the functions it calls.
+'''
+
+import collections
+import os
+import sys
+import time
+import types
+import typing
+
+import lib_carotte
+from lib_carotte import EquationVariable
+
+CallStack = typing.Tuple[typing.Tuple[types.CodeType, int], ...]
+
+class Statistics:
+    '''Equations created by a function or a call path'''
+    __slots__ = ('gates', 'bits', 'seconds')
+    def __init__(self) -> None:
+        self.gates: typing.Counter[str] = collections.Counter()
+        self.bits = 0
+        self.seconds = 0.
+
+    def add(self, other: 'Statistics') -> None:
+        '''Add the equations of `other`'''
+        self.gates.update(other.gates)
+        self.bits += other.bits
+        self.seconds += other.seconds
+
+    def summary(self) -> str:
+        '''Counts of the equations, per operator'''
+        return ", ".join(f"{op} {count}" for (op, count) in self.gates.most_common())
+
+class CallTree:
+    '''Node of the tree of the call paths, with the equations created below it'''
+    __slots__ = ('statistics', 'children')
+    def __init__(self) -> None:
+        self.statistics = Statistics()
+        self.children: typing.Dict[types.CodeType, 'CallTree'] = {}
+
+class Profiler: # pylint: disable=R0902
+    '''Records the call stack creating each equation of the active circuit
+
+    Use it as a context manager around the construction of the circuit. Frames of the
+    `stop_files` (e.g. the script calling the circuit main function) end the call stacks.'''
+    def __init__(self, stop_files: typing.Iterable[str] = ()) -> None:
+        self.skipped_files = {lib_carotte.__file__}
+        self.stop_files = set(stop_files)
+        self.stacks: typing.List[CallStack] = []
+        self.stack_ids: typing.Dict[CallStack, int] = {}
+        self.statistics: typing.List[Statistics] = []
+        self.origins: typing.Dict[EquationVariable, int] = {}
+        self.circuit: typing.Optional[lib_carotte.Circuit] = None
+        self.last_time = 0.
+
+    def __enter__(self) -> 'Profiler':
+        self.circuit = lib_carotte.current_circuit()
+        self.circuit.profiler = self
+        self.last_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: typing.Any) -> None:
+        assert self.circuit is not None
+        self.circuit.profiler = None
+
+    def record(self, eq: EquationVariable) -> None:
+        '''Record the creation of `eq`, called by the EquationVariable constructor'''
+        now = time.perf_counter()
+        frames = []
+        frame: typing.Optional[types.FrameType] = sys._getframe(1) # pylint: disable=W0212
+        while frame is not None and frame.f_code.co_filename not in self.stop_files:
+            if frame.f_code.co_filename not in self.skipped_files:
+                frames.append((frame.f_code, frame.f_lineno))
+            frame = frame.f_back
+        frames.reverse()
+        stack = tuple(frames)
+        k = self.stack_ids.get(stack)
+        if k is None:
+            k = self.stack_ids[stack] = len(self.stacks)
+            self.stacks.append(stack)
+            self.statistics.append(Statistics())
+        self.origins[eq] = k
+        statistics = self.statistics[k]
+        statistics.gates[type(eq).__name__] += 1
+        statistics.bits += eq.bus_size
+        statistics.seconds += now - self.last_time
+        # The time spent here is not charged to the next equation
+        self.last_time = time.perf_counter()
+
+    def origin(self, eq: EquationVariable) -> typing.List[typing.Tuple[str, str, int]]:
+        '''The (file, function, line) frames that created `eq`, outermost first'''
+        return [(code.co_filename, code.co_name, line) for (code, line) in self.stacks[self.origins[eq]]]
+
+    def flat(self) -> typing.Dict[typing.Optional[types.CodeType], Statistics]:
+        '''Equations per function directly creating them (None for the top-level code)'''
+        functions: typing.Dict[typing.Optional[types.CodeType], Statistics] = {}
+        for (stack, statistics) in zip(self.stacks, self.statistics):
+            functions.setdefault(stack[-1][0] if stack else None, Statistics()).add(statistics)
+        return functions
+
+    def tree(self) -> CallTree:
+        '''Tree of the call paths, the node of a function includes the functions it calls'''
+        root = CallTree()
+        for (stack, statistics) in zip(self.stacks, self.statistics):
+            node = root
+            node.statistics.add(statistics)
+            for (code, _) in stack:
+                node = node.children.setdefault(code, CallTree())
+                node.statistics.add(statistics)
+        return root
+
+    def report(self, f: typing.TextIO, min_share: float = 0.01) -> None:
+        '''Write the flat and tree views, without the tree nodes below `min_share` of the equations'''
+        root = self.tree()
+        total = root.statistics
+        f.write(f"{sum(total.gates.values())} equations, {total.bits} bits, {total.seconds:.3f}s\n\n")
+        f.write("Flat view (equations created by each function):\n")
+        f.write(f"{'gates':>10} {'bits':>10} {'time':>9}  function\n")
+        for (code, statistics) in sorted(self.flat().items(), key=lambda item: -sum(item[1].gates.values())):
+            f.write(f"{sum(statistics.gates.values()):>10} {statistics.bits:>10} {statistics.seconds:>8.3f}s  "
+                    f"{function_name(code)}: {statistics.summary()}\n")
+        f.write("\nTree view (equations created by each function and the functions it calls):\n")
+        f.write(f"{'gates':>10} {'bits':>10} {'time':>9}  function\n")
+        threshold = min_share * sum(total.gates.values())
+        stack = [(code, node, 0) for (code, node) in sorted(root.children.items(), key=tree_order, reverse=True)]
+        while stack:
+            (code, node, depth) = stack.pop()
+            gates = sum(node.statistics.gates.values())
+            if gates < threshold:
+                continue
+            f.write(f"{gates:>10} {node.statistics.bits:>10} {node.statistics.seconds:>8.3f}s  "
+                    f"{'  ' * depth}{function_name(code)}: {node.statistics.summary()}\n")
+            stack += [(child_code, child, depth + 1)
+                      for (child_code, child) in sorted(node.children.items(), key=tree_order, reverse=True)]
+
+def tree_order(item: typing.Tuple[types.CodeType, CallTree]) -> int:
+    '''Sort key of the tree nodes: most equations first'''
+    return -sum(item[1].statistics.gates.values())
+
+def function_name(code: typing.Optional[types.CodeType]) -> str:
+    '''Short description of a function'''
+    if code is None:
+        return "<top level>"
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
@@ -0,0 +1,538 @@
+# SPDX-License-Identifier: CC0-1.0
+# carotte.py by Twal, hbens & more
+
+'''Cycle-accurate simulation of the netlist built with lib_carotte
+
+Bus values are represented as python integers: the bit `i` of the integer holds
+the element `i` of the bus (i.e. `SELECT i x` is `(x >> i) & 1`).
+ROM and RAM addresses are the integer value of the address bus.
+`MUX c a b` is `a` when `c` is 0 and `b` when `c` is 1.
+
+`CompiledSimulator` generates one straight-line python function per netlist that
+simulates a whole cycle, so that no per-equation dispatch happens at runtime.
+
+`EventSimulator` propagates the changed values through the fan-out of the equations,
+and falls back to a full sweep when too many values change each cycle.
+
+`ParallelSimulator` runs independent testbenches of the compiled netlist in worker processes.
+
+`BatchSimulator` runs many independent simulations (lanes) at once: a bus of size n
+is stored as n NumPy uint64 rows (bit planes), each word holding one bit of 64 lanes.
+
+The ROM contents are given by ROM name, as sequences of words or `carotte_memory.RomImage`
+(memory-mapped files). The RAM contents are `carotte_memory.PagedMemory` (except in the batch
+simulator), allocated by pages when first written.
+'''
+
+import marshal
+import multiprocessing
+import types
+import typing
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None # type: ignore
+
+import lib_carotte
+from carotte_memory import (PAGE_BITS, PAGE_WORDS, PagedMemory, RomImage,
+                            load_memories, save_memories)
+from lib_carotte import (RAM, ROM, And, Concat, Constant, EquationVariable,
+                         Mux, Nand, Not, Or, Reg, Select, Slice, Variable, Xor,
+                         combinational_levels, combinational_operands,
+                         schedule)
+
+Values = typing.Dict[Variable, int]
+Roms = typing.Mapping[str, typing.Sequence[int]]
+
+def mask(bus_size: int) -> int:
+    '''Integer with the `bus_size` low bits set'''
+    return (1 << bus_size) - 1
+
+def constant_value(value: str) -> int:
+    '''Integer value of a netlist constant such as "0010"'''
+    return sum(1 << i for (i, c) in enumerate(value) if c in "1t")
+
+def bus_to_string(value: int, bus_size: int) -> str:
+    '''Netlist string form of a bus value (element 0 first)'''
+    return "".join("1" if (value >> i) & 1 else "0" for i in range(bus_size))
+
+def input_value(inputs: typing.Mapping[str, int], name: str, bus_size: int, cycle: int) -> int:
+    '''Value of the input `name` in the `inputs` of a cycle, checked against its bus size'''
+    if name not in inputs:
+        raise ValueError(f"Missing value for input '{name}' at cycle {cycle}")
+    value = inputs[name]
+    if not 0 <= value <= mask(bus_size):
+        raise ValueError(f"Value {value} of input '{name}' does not fit in {bus_size} bits")
+    return value
+
+def evaluate(eq: EquationVariable, values: Values, roms: Roms, rams: typing.Mapping[RAM, PagedMemory]) -> int:
+    '''Compute the value of `eq` for the current cycle'''
+    # pylint: disable=R0911,R0912
+    if isinstance(eq, Reg):
+        return values[eq]
+    if isinstance(eq, Not):
+        return ~values[eq.x.get_val()] & mask(eq.bus_size)
+    if isinstance(eq, And):
+        return values[eq.lhs.get_val()] & values[eq.rhs.get_val()]
+    if isinstance(eq, Or):
+        return values[eq.lhs.get_val()] | values[eq.rhs.get_val()]
+    if isinstance(eq, Xor):
+        return values[eq.lhs.get_val()] ^ values[eq.rhs.get_val()]
+    if isinstance(eq, Nand):
+        return ~(values[eq.lhs.get_val()] & values[eq.rhs.get_val()]) & mask(eq.bus_size)
+    if isinstance(eq, Mux):
+        return values[eq.b.get_val()] if values[eq.choice.get_val()] else values[eq.a.get_val()]
+    if isinstance(eq, Select):
+        return (values[eq.x.get_val()] >> eq.i) & 1
+    if isinstance(eq, Slice):
+        return (values[eq.x.get_val()] >> eq.i1) & mask(eq.bus_size)
+    if isinstance(eq, Concat):
+        return values[eq.lhs.get_val()] | (values[eq.rhs.get_val()] << eq.lhs.bus_size)
+    if isinstance(eq, Constant):
+        return constant_value(eq.value)
+    if isinstance(eq, ROM):
+        data = roms.get(eq.name, ())
+        addr = values[eq.read_addr.get_val()]
+        return data[addr] & mask(eq.word_size) if addr < len(data) else 0
+    if isinstance(eq, RAM):
+        return rams[eq].get(values[eq.read_addr.get_val()], 0)
+    raise TypeError(f"Cannot simulate equation '{eq}'")
+
+class Simulator: # pylint: disable=R0902
+    '''Simulates the current lib_carotte netlist, one cycle at a time'''
+    def __init__(self, roms: typing.Optional[Roms] = None):
+        lib_carotte.resolve_defers()
+        self.inputs = list(lib_carotte.get_inputs())
+        self.outputs = list(lib_carotte.get_outputs())
+        equations = lib_carotte.get_equations()
+        self.order = schedule(equations)
+        self.regs = [eq for eq in equations if isinstance(eq, Reg)]
+        # The images are read through their fastest sequence of words
+        self.roms = {name: data.words if isinstance(data, RomImage) else data for (name, data) in (roms or {}).items()}
+        self.rams = {eq: PagedMemory(eq.word_size) for eq in equations if isinstance(eq, RAM)}
+        self.values: Values = {eq: 0 for eq in self.regs}
+        self.cycle = 0
+
+    def set_inputs(self, inputs: typing.Mapping[str, int]) -> None:
+        '''Set the INPUT values for the current cycle'''
+        for x in self.inputs:
+            self.values[x] = input_value(inputs, x.name, x.bus_size, self.cycle)
+
+    def step(self, inputs: typing.Mapping[str, int]) -> typing.Dict[str, int]:
+        '''Simulate one cycle and return the OUTPUT values'''
+        self.set_inputs(inputs)
+        values = self.values
+        for eq in self.order:
+            values[eq] = evaluate(eq, values, self.roms, self.rams)
+        outputs = {x.name: values[x] for x in self.outputs}
+        self.end_cycle()
+        return outputs
+
+    def end_cycle(self) -> None:
+        '''Update the registers and write the RAMs: all of them see the values of the cycle'''
+        values = self.values
+        new_regs = [values[eq.x.get_val()] for eq in self.regs]
+        for (ram, memory) in self.rams.items():
+            if values[ram.write_enable.get_val()]:
+                memory[values[ram.write_addr.get_val()]] = values[ram.write_data.get_val()]
+        for (eq, value) in zip(self.regs, new_regs):
+            values[eq] = value
+        self.cycle += 1
+
+    def simulate(self, inputs_per_cycle: typing.Iterable[typing.Mapping[str, int]]
+                 ) -> typing.Iterator[typing.Dict[str, int]]:
+        '''Simulate one cycle per element of `inputs_per_cycle`, yielding the OUTPUT values'''
+        for inputs in inputs_per_cycle:
+            yield self.step(inputs)
+
+    def save_memories(self, filename: str) -> None:
+        '''Save the RAM contents to a NumPy .npz file'''
+        save_memories(filename, {ram.name: memory for (ram, memory) in self.rams.items()})
+
+    def load_memories(self, filename: str) -> None:
+        '''Load the RAM contents saved by `save_memories`'''
+        load_memories(filename, {ram.name: memory for (ram, memory) in self.rams.items()})
+
+DEFAULT_ACTIVITY_THRESHOLD = 0.35
+
+class EventSimulator(Simulator): # pylint: disable=R0902
+    '''Simulates the current lib_carotte netlist, re-evaluating only the fan-out of the changed values
+
+    The equations are evaluated level by level, so that each one is evaluated at most once per cycle.
+    When the activity factor (the average share of the equations whose value changes in a cycle)
+    reaches `activity_threshold`, the cycles are simulated by a full sweep instead, until it goes back below.
+    An activity threshold of 0 always sweeps, and a threshold of 1 is always event-driven.'''
+    def __init__(self, roms: typing.Optional[Roms] = None, activity_threshold: float = DEFAULT_ACTIVITY_THRESHOLD):
+        super().__init__(roms)
+        equations = lib_carotte.get_equations()
+        self.levels = combinational_levels(equations)
+        self.fanout: typing.Dict[Variable, typing.List[EquationVariable]] = {x: [] for x in self.inputs}
+        self.fanout.update((eq, []) for eq in equations)
+        for eq in self.order:
+            for x in set(combinational_operands(eq)):
+                self.fanout[x].append(eq)
+        self.buckets: typing.List[typing.List[EquationVariable]] = [[] for _ in range(max(self.levels.values(),
+                                                                                             default=-1) + 1)]
+        self.scheduled: typing.Set[EquationVariable] = set()
+        # Inputs, registers and written RAMs whose value changed since the last cycle
+        self.events: typing.List[Variable] = []
+        self.activity_threshold = activity_threshold
+        # The first cycle is a full sweep, as nothing has been evaluated yet
+        self.activity = 0.
+        self.event_cycles = 0
+
+    def set_inputs(self, inputs: typing.Mapping[str, int]) -> None:
+        old_values = [self.values.get(x) for x in self.inputs]
+        super().set_inputs(inputs)
+        self.events += [x for (x, value) in zip(self.inputs, old_values) if self.values[x] != value]
+
+    def sweep(self) -> int:
+        '''Evaluate all the equations, returns the number of changed values'''
+        (values, roms, rams) = (self.values, self.roms, self.rams)
+        changed = 0
+        for eq in self.order:
+            value = evaluate(eq, values, roms, rams)
+            if values.get(eq) != value:
+                values[eq] = value
+                changed += 1
+        return changed
+
+    def propagate(self) -> int:
+        '''Evaluate the fan-out of the events, level by level; returns the number of changed values'''
+        (values, roms, rams) = (self.values, self.roms, self.rams)
+        (fanout, levels, buckets, scheduled) = (self.fanout, self.levels, self.buckets, self.scheduled)
+        for x in self.events:
+            # A written RAM is re-read, the other events are sources whose readers are evaluated
+            for eq in (x,) if isinstance(x, RAM) else fanout[x]:
+                if eq not in scheduled:
+                    scheduled.add(eq)
+                    buckets[levels[eq]].append(eq)
+        changed = 0
+        for bucket in buckets:
+            # The readers of an equation have a higher level, so the bucket does not grow while read
+            for eq in bucket:
+                value = evaluate(eq, values, roms, rams)
+                if values[eq] != value:
+                    values[eq] = value
+                    changed += 1
+                    for reader in fanout[eq]:
+                        if reader not in scheduled:
+                            scheduled.add(reader)
+                            buckets[levels[reader]].append(reader)
+            bucket.clear()
+        scheduled.clear()
+        return changed
+
+    def step(self, inputs: typing.Mapping[str, int]) -> typing.Dict[str, int]:
+        '''Simulate one cycle and return the OUTPUT values'''
+        self.set_inputs(inputs)
+        if self.cycle == 0:
+            self.sweep()
+        else:
+            if self.activity >= self.activity_threshold:
+                changed = self.sweep()
+            else:
+                changed = self.propagate()
+                self.event_cycles += 1
+            # Exponential moving average of the share of changed values
+            self.activity += (changed / max(len(self.order), 1) - self.activity) / 8
+        self.events.clear()
+        outputs = {x.name: self.values[x] for x in self.outputs}
+        self.end_cycle()
+        return outputs
+
+    def load_memories(self, filename: str) -> None:
+        super().load_memories(filename)
+        self.events += self.rams
+
+    def end_cycle(self) -> None:
+        values = self.values
+        old_regs = [values[eq] for eq in self.regs]
+        for ram in self.rams:
+            if values[ram.write_enable.get_val()]:
+                self.events.append(ram)
+        super().end_cycle()
+        self.events += [eq for (eq, value) in zip(self.regs, old_regs) if values[eq] != value]
+
+def simulate(inputs_per_cycle: typing.Iterable[typing.Mapping[str, int]], roms: typing.Optional[Roms] = None
+             ) -> typing.Iterator[typing.Dict[str, int]]:
+    '''Simulate the current netlist, yielding the OUTPUT values of each cycle'''
+    return Simulator(roms).simulate(inputs_per_cycle)
+
+_code_cache: typing.Dict[str, types.CodeType] = {}
+
+def expression(eq: EquationVariable, local: typing.Callable[[Variable], str]) -> str:
+    '''Python expression computing the value of `eq`, given the local variable names of the operands'''
+    # pylint: disable=R0911,R0912
+    if isinstance(eq, Not):
+        return f"{local(eq.x.get_val())} ^ {mask(eq.bus_size)}"
+    if isinstance(eq, And):
+        return f"{local(eq.lhs.get_val())} & {local(eq.rhs.get_val())}"
+    if isinstance(eq, Or):
+        return f"{local(eq.lhs.get_val())} | {local(eq.rhs.get_val())}"
+    if isinstance(eq, Xor):
+        return f"{local(eq.lhs.get_val())} ^ {local(eq.rhs.get_val())}"
+    if isinstance(eq, Nand):
+        return f"({local(eq.lhs.get_val())} & {local(eq.rhs.get_val())}) ^ {mask(eq.bus_size)}"
+    if isinstance(eq, Mux):
+        return f"{local(eq.b.get_val())} if {local(eq.choice.get_val())} else {local(eq.a.get_val())}"
+    if isinstance(eq, Select):
+        return f"({local(eq.x.get_val())} >> {eq.i}) & 1"
+    if isinstance(eq, Slice):
+        return f"({local(eq.x.get_val())} >> {eq.i1}) & {mask(eq.bus_size)}"
+    if isinstance(eq, Concat):
+        return f"{local(eq.lhs.get_val())} | ({local(eq.rhs.get_val())} << {eq.lhs.bus_size})"
+    if isinstance(eq, Constant):
+        return str(constant_value(eq.value))
+    if isinstance(eq, ROM):
+        addr = local(eq.read_addr.get_val())
+        return f"{local(eq)}_data[{addr}] & {mask(eq.word_size)} if {addr} < len({local(eq)}_data) else 0"
+    if isinstance(eq, RAM):
+        addr = local(eq.read_addr.get_val())
+        return f"{local(eq)}_pages.get({addr} >> {PAGE_BITS}, {local(eq)}_zero)[{addr} & {PAGE_WORDS - 1}]"
+    raise TypeError(f"Cannot simulate equation '{eq}'")
+
+class CompiledSimulator(Simulator):
+    '''Simulates the current lib_carotte netlist with a generated python function per cycle'''
+    def __init__(self, roms: typing.Optional[Roms] = None):
+        super().__init__(roms)
+        local_names: typing.Dict[Variable, str] = {x: f"i{k}" for (k, x) in enumerate(self.inputs)}
+        local_names.update((eq, f"v{k}") for (k, eq) in enumerate(self.order))
+        self.source = self.generate(local_names.__getitem__)
+        if self.source not in _code_cache:
+            _code_cache[self.source] = compile(self.source, "<carotte cycle>", "exec")
+        namespace: typing.Dict[str, typing.Any] = {}
+        self.code = _code_cache[self.source]
+        exec(self.code, namespace) # pylint: disable=W0122
+        self.cycle_function = namespace["cycle"]
+        self.rom_data = tuple(self.roms.get(eq.name, ()) for eq in self.order if isinstance(eq, ROM))
+        self.ram_data = tuple(self.rams[eq] for eq in self.order if isinstance(eq, RAM))
+        self.state = [0] * len(self.regs)
+
+    def generate(self, local: typing.Callable[[Variable], str]) -> str:
+        '''Source code of the function simulating one cycle'''
+        lines = ["def cycle(inputs, state, roms, rams):"]
+        lines += [f"    {local(x)} = inputs[{k}]" for (k, x) in enumerate(self.inputs)]
+        lines += [f"    {local(eq)} = state[{k}]" for (k, eq) in enumerate(self.regs)]
+        lines += [f"    {local(eq)}_data = roms[{k}]"
+                  for (k, eq) in enumerate(eq for eq in self.order if isinstance(eq, ROM))]
+        rams = [eq for eq in self.order if isinstance(eq, RAM)]
+        for (k, eq) in enumerate(rams):
+            lines += [f"    {local(eq)}_data = rams[{k}]", f"    {local(eq)}_pages = {local(eq)}_data.pages",
+                      f"    {local(eq)}_zero = {local(eq)}_data.zero_page"]
+        lines += [f"    {local(eq)} = {expression(eq, local)}" for eq in self.order if not isinstance(eq, Reg)]
+        for eq in rams:
+            lines.append(f"    if {local(eq.write_enable.get_val())}:")
+            lines.append(f"        {local(eq)}_data[{local(eq.write_addr.get_val())}] = "
+                         + local(eq.write_data.get_val()))
+        lines.append("    state[:] = (" + "".join(f"{local(eq.x.get_val())}, " for eq in self.regs) + ")")
+        lines.append("    return (" + "".join(f"{local(x)}, " for x in self.outputs) + ")")
+        return "\n".join(lines) + "\n"
+
+    def step(self, inputs: typing.Mapping[str, int]) -> typing.Dict[str, int]:
+        '''Simulate one cycle and return the OUTPUT values'''
+        self.set_inputs(inputs)
+        outputs = self.cycle_function([self.values[x] for x in self.inputs], self.state, self.rom_data,
+                                      self.ram_data)
+        self.cycle += 1
+        return dict(zip((x.name for x in self.outputs), outputs))
+
+class CompiledProgram(typing.NamedTuple):
+    '''What the worker processes need to run the cycle function of a CompiledSimulator'''
+    code: bytes
+    inputs: typing.Tuple[typing.Tuple[str, int], ...]
+    outputs: typing.Tuple[str, ...]
+    regs: int
+    roms: typing.Tuple[typing.Sequence[int], ...]
+    ram_word_sizes: typing.Tuple[int, ...]
+
+# Program of the worker process and its cycle function, set by the pool initializer
+_worker_program: typing.Optional[typing.Tuple[CompiledProgram, typing.Callable[..., typing.Tuple[int, ...]],
+                                              typing.Tuple[typing.Sequence[int], ...]]] = None
+
+def init_worker(program: CompiledProgram) -> None:
+    '''Load the compiled program once per worker process'''
+    global _worker_program # pylint: disable=W0603
+    namespace: typing.Dict[str, typing.Any] = {}
+    exec(marshal.loads(program.code), namespace) # pylint: disable=W0122
+    roms = tuple(data.words if isinstance(data, RomImage) else data for data in program.roms)
+    _worker_program = (program, namespace["cycle"], roms)
+
+def run_testbench(inputs_per_cycle: typing.Sequence[typing.Mapping[str, int]]) -> typing.List[typing.Dict[str, int]]:
+    '''Simulate a testbench from the initial state in a worker process, returns the OUTPUT values of each cycle'''
+    assert _worker_program is not None
+    (program, cycle_function, roms) = _worker_program
+    state = [0] * program.regs
+    rams = tuple(PagedMemory(word_size) for word_size in program.ram_word_sizes)
+    trace = []
+    for (cycle, inputs) in enumerate(inputs_per_cycle):
+        values = [input_value(inputs, name, bus_size, cycle) for (name, bus_size) in program.inputs]
+        trace.append(dict(zip(program.outputs, cycle_function(values, state, roms, rams))))
+    return trace
+
+class ParallelSimulator:
+    '''Simulates independent testbenches of the current lib_carotte netlist with a pool of worker processes
+
+    The netlist is scheduled and compiled once, and each worker process receives the compiled
+    cycle function once, when it starts. Each testbench (a sequence of inputs per cycle) starts
+    from the initial state, the traces are yielded in the order of the testbenches.'''
+    def __init__(self, roms: typing.Optional[Roms] = None, jobs: typing.Optional[int] = None):
+        simulator = CompiledSimulator(roms)
+        rom_names = [eq.name for eq in simulator.order if isinstance(eq, ROM)]
+        # ROM images are reopened by the workers rather than copied
+        self.program = CompiledProgram(marshal.dumps(simulator.code),
+                                       tuple((x.name, x.bus_size) for x in simulator.inputs),
+                                       tuple(x.name for x in simulator.outputs), len(simulator.regs),
+                                       tuple((roms or {}).get(name, ()) for name in rom_names),
+                                       tuple(memory.word_size for memory in simulator.ram_data))
+        self.jobs = jobs
+
+    def simulate(self, testbenches: typing.Iterable[typing.Sequence[typing.Mapping[str, int]]]
+                 ) -> typing.Iterator[typing.List[typing.Dict[str, int]]]:
+        '''Simulate each testbench in a worker process, yielding the OUTPUT values of its cycles'''
+        with multiprocessing.Pool(self.jobs, initializer=init_worker, initargs=(self.program,)) as pool:
+            yield from pool.imap(run_testbench, testbenches)
+
+def simulate_parallel(testbenches: typing.Iterable[typing.Sequence[typing.Mapping[str, int]]],
+                      roms: typing.Optional[Roms] = None, jobs: typing.Optional[int] = None
+                      ) -> typing.Iterator[typing.List[typing.Dict[str, int]]]:
+    '''Simulate independent testbenches of the current netlist in parallel, yielding the trace of each one'''
+    return ParallelSimulator(roms, jobs).simulate(testbenches)
+
+LANES_PER_WORD = 64
+MAX_BATCH_MEMORY_WORDS = 1 << 28
+
+def planes_to_ints(planes: 'np.ndarray', lanes: int) -> 'np.ndarray':
+    '''Per-lane integer values of a bus stored as bit planes (at most 64 bits)'''
+    (bus_size, words) = planes.shape
+    shifts = np.arange(LANES_PER_WORD, dtype=np.uint64)
+    bits = ((planes[:, :, None] >> shifts) & np.uint64(1)).reshape(bus_size, words * LANES_PER_WORD)[:, :lanes]
+    return (bits << np.arange(bus_size, dtype=np.uint64)[:, None]).sum(axis=0, dtype=np.uint64)
+
+def ints_to_planes(values: 'np.ndarray', bus_size: int, words: int) -> 'np.ndarray':
+    '''Bit planes of a bus from its per-lane integer values (at most 64 bits)'''
+    padded = np.zeros(words * LANES_PER_WORD, dtype=np.uint64)
+    padded[:len(values)] = values
+    bits = (padded[None, :] >> np.arange(bus_size, dtype=np.uint64)[:, None]) & np.uint64(1)
+    shifts = np.arange(LANES_PER_WORD, dtype=np.uint64)
+    return (bits.reshape(bus_size, words, LANES_PER_WORD) << shifts).sum(axis=2, dtype=np.uint64)
+
+def rom_array(data: typing.Sequence[int]) -> 'np.ndarray':
+    '''ROM contents as a non-empty NumPy array (without copying the raw images when possible)'''
+    if len(data) == 0:
+        return np.zeros(1, dtype=np.uint64)
+    if isinstance(data, RomImage):
+        return data.numpy()
+    return np.array(data, dtype=np.uint64)
+
+class BatchSimulator: # pylint: disable=R0902
+    '''Simulates the current lib_carotte netlist on many independent lanes at once'''
+    def __init__(self, lanes: int, roms: typing.Optional[Roms] = None):
+        if np is None:
+            raise RuntimeError("Install module 'numpy' to use the batch simulator")
+        if lanes <= 0:
+            raise ValueError(f"The number of lanes must be positive (have {lanes})")
+        lib_carotte.resolve_defers()
+        self.lanes = lanes
+        self.words = (lanes + LANES_PER_WORD - 1) // LANES_PER_WORD
+        self.inputs = list(lib_carotte.get_inputs())
+        self.outputs = list(lib_carotte.get_outputs())
+        equations = lib_carotte.get_equations()
+        self.order = schedule(equations)
+        self.regs = [eq for eq in equations if isinstance(eq, Reg)]
+        self.roms = {eq: rom_array((roms or {}).get(eq.name, ())) for eq in equations if isinstance(eq, ROM)}
+        self.rams: typing.Dict[RAM, np.ndarray] = {}
+        for eq in equations:
+            if isinstance(eq, RAM):
+                if eq.word_size > 64 or (1 << eq.addr_size) * lanes > MAX_BATCH_MEMORY_WORDS:
+                    raise ValueError(f"RAM '{eq.name}' is too large for the batch simulator")
+                self.rams[eq] = np.zeros((1 << eq.addr_size, lanes), dtype=np.uint64)
+        self.values: typing.Dict[Variable, np.ndarray] = {eq: self.zeros(eq.bus_size) for eq in self.regs}
+        self.cycle = 0
+
+    def zeros(self, bus_size: int) -> 'np.ndarray':
+        '''Bit planes of an all-zero bus'''
+        return np.zeros((bus_size, self.words), dtype=np.uint64)
+
+    def lane_values(self, x: Variable) -> 'np.ndarray':
+        '''Per-lane integer values of a variable of the current cycle'''
+        if x.bus_size > 64:
+            raise ValueError(f"Variable '{x.name}' is wider than 64 bits")
+        return planes_to_ints(self.values[x], self.lanes)
+
+    def evaluate(self, eq: EquationVariable) -> 'np.ndarray':
+        '''Compute the bit planes of `eq` for the current cycle'''
+        # pylint: disable=R0911,R0912
+        values = self.values
+        if isinstance(eq, Reg):
+            return values[eq]
+        if isinstance(eq, Not):
+            return ~values[eq.x.get_val()]
+        if isinstance(eq, And):
+            return values[eq.lhs.get_val()] & values[eq.rhs.get_val()]
+        if isinstance(eq, Or):
+            return values[eq.lhs.get_val()] | values[eq.rhs.get_val()]
+        if isinstance(eq, Xor):
+            return values[eq.lhs.get_val()] ^ values[eq.rhs.get_val()]
+        if isinstance(eq, Nand):
+            return ~(values[eq.lhs.get_val()] & values[eq.rhs.get_val()])
+        if isinstance(eq, Mux):
+            choice = values[eq.choice.get_val()]
+            return (values[eq.a.get_val()] & ~choice) | (values[eq.b.get_val()] & choice)
+        if isinstance(eq, Select):
+            return values[eq.x.get_val()][eq.i:eq.i + 1]
+        if isinstance(eq, Slice):
+            return values[eq.x.get_val()][eq.i1:eq.i2 + 1]
+        if isinstance(eq, Concat):
+            return np.concatenate((values[eq.lhs.get_val()], values[eq.rhs.get_val()]))
+        if isinstance(eq, Constant):
+            return np.array([[~np.uint64(0) if c in "1t" else np.uint64(0)] * self.words for c in eq.value],
+                            dtype=np.uint64)
+        if isinstance(eq, ROM):
+            data = self.roms[eq]
+            addr = self.lane_values(eq.read_addr.get_val())
+            words = np.where(addr < len(data), data[np.minimum(addr, len(data) - 1)], 0)
+            return ints_to_planes(words & np.uint64(mask(eq.word_size)), eq.word_size, self.words)
+        if isinstance(eq, RAM):
+            addr = self.lane_values(eq.read_addr.get_val())
+            return ints_to_planes(self.rams[eq][addr, np.arange(self.lanes)], eq.word_size, self.words)
+        raise TypeError(f"Cannot simulate equation '{eq}'")
+
+    def step(self, inputs: typing.Mapping[str, typing.Sequence[int]]) -> typing.Dict[str, 'np.ndarray']:
+        '''Simulate one cycle; inputs and outputs map names to per-lane values'''
+        for x in self.inputs:
+            if x.name not in inputs:
+                raise ValueError(f"Missing value for input '{x.name}' at cycle {self.cycle}")
+            if x.bus_size > 64:
+                raise ValueError(f"Input '{x.name}' is wider than 64 bits")
+            try:
+                lane_values = np.asarray(inputs[x.name], dtype=np.uint64)
+            except OverflowError as e:
+                raise ValueError(f"Negative value of input '{x.name}'") from e
+            if lane_values.shape != (self.lanes,):
+                raise ValueError(f"Input '{x.name}' must have one value per lane ({self.lanes})")
+            too_wide = np.flatnonzero(lane_values > np.uint64(mask(x.bus_size)))
+            if len(too_wide):
+                raise ValueError(f"Value {lane_values[too_wide[0]]} of input '{x.name}' (lane {too_wide[0]}) "
+                                 f"does not fit in {x.bus_size} bits")
+            self.values[x] = ints_to_planes(lane_values, x.bus_size, self.words)
+        for eq in self.order:
+            self.values[eq] = self.evaluate(eq)
+        outputs = {x.name: self.lane_values(x) for x in self.outputs}
+        # End of the cycle: registers and RAM writes all see the values of this cycle
+        new_regs = [self.values[eq.x.get_val()] for eq in self.regs]
+        for (ram, memory) in self.rams.items():
+            enabled = self.lane_values(ram.write_enable.get_val()).astype(bool)
+            addr = self.lane_values(ram.write_addr.get_val())[enabled]
+            memory[addr, np.arange(self.lanes)[enabled]] = self.lane_values(ram.write_data.get_val())[enabled]
+        for (eq, value) in zip(self.regs, new_regs):
+            self.values[eq] = value
+        self.cycle += 1
+        return outputs
+
+    def simulate(self, inputs_per_cycle: typing.Iterable[typing.Mapping[str, typing.Sequence[int]]]
+                 ) -> typing.Iterator[typing.Dict[str, 'np.ndarray']]:
+        '''Simulate one cycle per element of `inputs_per_cycle`, yielding the per-lane OUTPUT values'''
+        for inputs in inputs_per_cycle:
+            yield self.step(inputs)
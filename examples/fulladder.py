@@ -6,8 +6,9 @@
 from lib_carotte import *
 
 
+@block_template
 def full_adder(a: Variable, b: Variable, c: Variable) -> typing.Tuple[Variable, Variable]:
-    '''1-bit full adder implementation'''
+    '''1-bit full adder implementation, built once and then stamped out'''
     tmp = a ^ b
     return (tmp ^ c, (tmp & c) | (a & b))
 
@@ -28,6 +28,16 @@ def adder_alt(a: Variable, b: Variable, c_in: Variable) -> typing.Tuple[Variable
                                           (r[0] if x[0] is None else x[0]+r[0], r[1]) # type: ignore
                                          )(), zip(a, b), (None, c_in))
 
+def adder_iter(a: Variable, b: Variable, c_in: Variable) -> typing.Tuple[Variable, Variable]:
+    '''n-bit full-adder iterative implementation, for wide buses'''
+    assert a.bus_size == b.bus_size
+    res = []
+    c = c_in
+    for i in range(a.bus_size):
+        (res_i, c) = fulladder.full_adder(a[i], b[i], c)
+        res.append(res_i)
+    return (concat_all(res), c)
+
 def main() -> None:
     '''Entry point of this example'''
     n = 4
@@ -30,6 +30,11 @@ def or_n_alt2(a: Variable, b: Variable) -> Variable:
     assert c
     return c
 
+def or_n_iter(a: Variable, b: Variable) -> Variable:
+    '''n-bit logical OR iterative implementation, for wide buses'''
+    assert a.bus_size == b.bus_size
+    return concat_all(x | y for x, y in zip(a, b))
+
 def main() -> None:
     '''Entry point of this example'''
     addr_size = 2
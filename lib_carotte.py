@@ -3,6 +3,11 @@
 
 '''Carotte library internals'''
 
+import abc
+import contextvars
+import functools
+import io
+import itertools
 import sys
 import typing
 
@@ -16,46 +21,202 @@ class FakeColorama:
             self.Style = FakeColorama(depth+1)
             self.Style.RESET_ALL = '' # type: ignore
 
-try:
-    import colorama  # type: ignore
-except ModuleNotFoundError:
-    print("Warning: Install module 'colorama' for colored errors", file=sys.stderr)
-    colorama = FakeColorama() # type: ignore
-
-_equation_counter = 0
-_input_list: typing.List['Variable'] = []
-_equation_list: typing.List['Variable'] = []
-_output_list = []
-_name_set = set()
-_unevaluated_defer_set = set()
-_ALLOW_RIBBON_LOGIC_OPERATIONS = False
+@functools.lru_cache(maxsize=None)
+def get_colorama() -> typing.Any:
+    '''The colorama module, only imported when colors are needed'''
+    try:
+        import colorama  # type: ignore # pylint: disable=C0415
+    except ModuleNotFoundError:
+        print("Warning: Install module 'colorama' for colored errors", file=sys.stderr)
+        return FakeColorama()
+    return colorama
+
+class Circuit:
+    '''A netlist being built, with its options
+
+    The module-level functions and the variable constructors act on the active circuit:
+    the circuit of the innermost `with Circuit():` block of the current thread or
+    asyncio task, or the default circuit outside of such blocks. Variables must only
+    be used while the circuit they were created in is active.'''
+    # pylint: disable=R0902
+    def __init__(self, ribbon_logic_operations: bool = False, hash_consing: bool = False):
+        self.allow_ribbon_logic_operations = ribbon_logic_operations
+        self.hash_consing = hash_consing
+        # Set while the first instance of a block template is built
+        self.recorder: typing.Optional['BlockRecorder'] = None
+        # Set while the creation of the equations is profiled, see carotte_profile.py
+        self.profiler: typing.Optional[typing.Any] = None
+        self._tokens: typing.List[contextvars.Token['Circuit']] = []
+        self.reset()
+
+    def reset(self) -> None:
+        '''Reset the netlist, keeping the options'''
+        self.equation_counter = 0
+        self.inputs: typing.List['Variable'] = []
+        self.equations: typing.List['EquationVariable'] = []
+        self.outputs: typing.List['Variable'] = []
+        # The variables of `outputs`, to check membership in constant time
+        self.output_set: typing.Set['Variable'] = set()
+        # Chosen names only, the automatic names are resolved by `resolve_names`
+        self.names: typing.Set[str] = set()
+        self.pending_defers: typing.List['Defer'] = []
+        self.hash_consing_table: typing.Dict[typing.Tuple[typing.Any, ...], 'EquationVariable'] = {}
+
+    def __enter__(self) -> 'Circuit':
+        self._tokens.append(_current_circuit.set(self))
+        return self
+
+    def __exit__(self, *exc_info: typing.Any) -> None:
+        _current_circuit.reset(self._tokens.pop())
+
+    def get_and_increment_equation_counter(self) -> int:
+        '''Return the current equation counter, and increment it'''
+        old_value = self.equation_counter
+        self.equation_counter += 1
+        return old_value
+
+    def resolve_defers(self) -> None:
+        '''Evaluate all pending Defer nodes'''
+        # The equations might contain Defer nodes that are not yet evaluated,
+        # and their evaluation could create new equations and new Defer nodes.
+        # The Defer nodes are appended to the worklist when they are created,
+        # so that a single pass evaluates all of them in creation order
+        with self:
+            k = 0
+            while k < len(self.pending_defers):
+                self.pending_defers[k].get_val()
+                k += 1
+            self.pending_defers.clear()
+
+    def set_equations(self, equations: typing.List['EquationVariable']) -> None:
+        '''Replace the netlist equations, e.g. after an optimization pass'''
+        kept = set(equations)
+        for eq in self.equations:
+            if eq not in kept and eq.chosen_name is not None:
+                self.names.remove(eq.chosen_name)
+        self.equations[:] = equations
+        # The operands of the remaining equations may have changed
+        self.hash_consing_table.clear()
+
+    def resolve_names(self) -> None:
+        '''Give a new name to the variables whose automatic name has been chosen by another variable'''
+        prefixes = (Input.default_name_prefix, EquationVariable.default_name_prefix)
+        if not any(name.startswith(prefixes) for name in self.names):
+            return
+        for x in itertools.chain(self.inputs, self.equations):
+            if x.chosen_name is None and x.name in self.names:
+                while x.name in self.names:
+                    x.id = self.get_and_increment_equation_counter()
+                x.chosen_name = x.default_name_prefix + str(x.id)
+                self.names.add(x.chosen_name)
+
+    def write_netlist(self, f: typing.TextIO, levelized: bool = False, annotate_levels: bool = False) -> None:
+        '''Write the netlist to a text file, without building it in memory
+
+        With `levelized`, each equation comes after the equations it combinationally reads.
+        With `annotate_levels` (implying `levelized`), a `# level N` comment starts each level.'''
+
+        self.resolve_defers()
+        self.resolve_names()
+
+        old_lens = (len(self.inputs), len(self.outputs), len(self.equations))
+        levels = combinational_levels(self.equations) if levelized or annotate_levels else None
+        # Stable sort: creation order within a level
+        equations = self.equations if levels is None else sorted(self.equations, key=levels.__getitem__)
+
+        # The automatic names are read several times each: build them once for this emission
+        unnamed = [x for x in itertools.chain(self.inputs, self.equations) if x.chosen_name is None]
+        for x in unnamed:
+            x.chosen_name = x.default_name_prefix + str(x.id)
+        try:
+            f.write("INPUT ")
+            write_chunked(f, (x.name for x in self.inputs), ", ")
+            f.write("\nOUTPUT ")
+            write_chunked(f, (x.name for x in self.outputs), ", ")
+            f.write("\nVAR ")
+            write_chunked(f, (x.get_full_name() for x in itertools.chain(self.inputs, equations)), ", ")
+            f.write("\nIN\n")
+            if annotate_levels:
+                assert levels is not None
+                write_chunked(f, ((f"# level {levels[x]}\n" if k == 0 or levels[x] != levels[equations[k - 1]] else "")
+                                  + str(x) + "\n" for (k, x) in enumerate(equations)), "")
+            else:
+                write_chunked(f, (str(x) + "\n" for x in equations), "")
+        finally:
+            for x in unnamed:
+                x.chosen_name = None
+
+        # Sanity check
+        new_lens = (len(self.inputs), len(self.outputs), len(self.equations))
+        if new_lens != old_lens:
+            raise RuntimeError("Internal error: inconsistent lengths, please report a bug")
+
+    def get_netlist(self, levelized: bool = False, annotate_levels: bool = False) -> str:
+        '''Get the netlist in string form, see `write_netlist` for the options'''
+        netlist = io.StringIO()
+        self.write_netlist(netlist, levelized, annotate_levels)
+        return netlist.getvalue()
+
+_current_circuit: contextvars.ContextVar[Circuit] = contextvars.ContextVar('carotte_circuit', default=Circuit())
+
+def current_circuit() -> Circuit:
+    '''The active circuit'''
+    return _current_circuit.get()
 
 def allow_ribbon_logic_operations(enable : bool) -> None:
     '''Enable or disable ribbon logic operations'''
-    global _ALLOW_RIBBON_LOGIC_OPERATIONS # pylint: disable=W0603
-    _ALLOW_RIBBON_LOGIC_OPERATIONS = enable
+    _current_circuit.get().allow_ribbon_logic_operations = enable
+
+def enable_hash_consing(enable : bool) -> None:
+    '''Enable or disable hash-consing: building a gate identical to an existing one returns the existing one'''
+    _current_circuit.get().hash_consing = enable
 
 def get_and_increment_equation_counter() -> int:
-    '''Return the current global equation counter, and increment it'''
-    global _equation_counter # pylint: disable=W0603
-    old_value = _equation_counter
-    _equation_counter += 1
-    return old_value
+    '''Return the current equation counter of the active circuit, and increment it'''
+    return _current_circuit.get().get_and_increment_equation_counter()
 
 class Variable(typing.Sequence['Variable']):
-    '''The basis of carotte.py: netlist variables core'''
-    def __init__(self, name: str, bus_size: int, autogen_name: bool = True):
-        assert name not in _name_set
+    '''The basis of carotte.py: netlist variables core
+
+    Variables without a chosen name only carry an integer id, their name
+    (e.g. `_l_<id>`) is built when needed and made unique by `resolve_names`'''
+    __slots__ = ('chosen_name', 'id', 'autogen_name', 'bus_size')
+    default_name_prefix: typing.ClassVar[str] = "_l_"
+    def __init__(self, name: typing.Optional[str], bus_size: int, autogen_name: bool = True):
         assert bus_size >= 0
-        _name_set.add(name)
-        self.name = name
+        circuit = _current_circuit.get()
+        self.chosen_name = name
+        if name is None:
+            self.id = circuit.get_and_increment_equation_counter()
+        else:
+            assert name not in circuit.names
+            circuit.names.add(name)
+            self.id = -1
         self.autogen_name = autogen_name
         self.bus_size = bus_size
+    @property
+    def name(self) -> str:
+        '''The variable name'''
+        if self.chosen_name is None:
+            return self.default_name_prefix + str(self.id)
+        return self.chosen_name
+    def get_val(self) -> 'Variable':
+        '''Returns the variable itself, for symmetry with `Defer.get_val`'''
+        return self
     def set_as_output(self, name: typing.Optional[str] = None) -> None:
         '''Sets this variable as a netlist OUTPUT'''
+        circuit = _current_circuit.get()
+        if circuit.recorder is not None:
+            circuit.recorder.call(Variable.set_as_output, (self, name), {})
+            return
+        if self in circuit.output_set:
+            # E.g. a gate shared by hash-consing: each OUTPUT needs its own variable, use a copy
+            Slice(0, self.bus_size, self).set_as_output(name)
+            return
         if name is not None:
             self.rename(name)
-        _output_list.append(self)
+        circuit.outputs.append(self)
+        circuit.output_set.add(self)
     def get_full_name(self) -> str:
         '''Returns the full name of this variable for the VARIABLE part of the netlist'''
         if self.bus_size == 1:
@@ -64,16 +225,25 @@ class Variable(typing.Sequence['Variable']):
 
     def rename(self, new_name: str, autogen_name: bool = False) -> None:
         '''Rename the variable; can fail'''
+        circuit = _current_circuit.get()
+        if circuit.recorder is not None:
+            circuit.recorder.call(Variable.rename, (self, new_name, autogen_name), {})
+            return
         if self.name != new_name:
-            if new_name in _name_set:
+            names = circuit.names
+            if new_name in names:
                 raise ValueError(f"Rename failed: the variable name '{new_name}' is already used!")
-            _name_set.remove(self.name)
-            _name_set.add(new_name)
-            self.name = new_name
+            if self.chosen_name is not None:
+                names.remove(self.chosen_name)
+            names.add(new_name)
+            self.chosen_name = new_name
             self.autogen_name = autogen_name
 
     def try_rename(self, new_name: str, autogen_name: bool = False) -> bool:
         '''Rename the variable if the new name is available and deemed better than the old one'''
+        recorder = _current_circuit.get().recorder
+        if recorder is not None:
+            return typing.cast(bool, recorder.call(Variable.try_rename, (self, new_name, autogen_name), {}))
         if not self.autogen_name and autogen_name:
             return False
         try:
@@ -85,16 +255,20 @@ class Variable(typing.Sequence['Variable']):
     def __assignpre__(self, lhs_name: str, rhs_name: str, rhs: typing.Any) -> typing.Any:
         '''Magic hook for better variables names'''
         if False: # pylint: disable=W0125
-            print(f'{colorama.Fore.YELLOW}PRE: assigning {lhs_name} = {rhs_name}  ||| var: {rhs.get_full_name()}')
+            print(f'{get_colorama().Fore.YELLOW}PRE: assigning {lhs_name} = {rhs_name}  ||| var: {rhs.get_full_name()}')
         return rhs
 
     def __assignpost__(self, lhs_name: str, rhs_name: str) -> None:
         '''Magic hook for better variables names'''
         if False: # pylint: disable=W0125
             print(f'POST: assigning {lhs_name} = {rhs_name}  ||| var{self.autogen_name}: {self.get_full_name()}')
+        circuit = _current_circuit.get()
+        if circuit.recorder is not None:
+            circuit.recorder.call(Variable.__assignpost__, (self, lhs_name, rhs_name), {})
+            return
         if self.autogen_name and (lhs_name is not None):
             new_name = lhs_name
-            if new_name in _name_set:
+            if new_name in circuit.names:
                 new_name = '_' + lhs_name + '_' + str(get_and_increment_equation_counter())
             self.try_rename(new_name)
 
@@ -123,16 +297,19 @@ class Variable(typing.Sequence['Variable']):
 
 class Defer:
     '''For handling loops in variable declarations'''
+    __slots__ = ('val', 'lazy_val', 'bus_size', 'autogen_name')
     def __init__(self, bus_size: int, lazy_val: typing.Callable[[], Variable]):
         self.val: typing.Optional[Variable] = None
         self.lazy_val = lazy_val
         self.bus_size = bus_size
         self.autogen_name = True
-        _unevaluated_defer_set.add(self)
+        circuit = _current_circuit.get()
+        if circuit.recorder is not None:
+            circuit.recorder.replayable = False
+        circuit.pending_defers.append(self)
     def get_val(self) -> Variable:
         '''Helper to resolve the variable value once the loop issue has been solved'''
         if self.val is None:
-            _unevaluated_defer_set.remove(self)
             self.val = self.lazy_val()
             assert self.val.bus_size == self.bus_size
         return self.val
@@ -145,30 +322,57 @@ VariableOrDefer = typing.Union[Variable, Defer]
 
 class Input(Variable):
     '''A netlist variable of type INPUT'''
+    __slots__ = ()
+    default_name_prefix = "_input_"
     def __init__(self, bus_size: int, name: typing.Optional[str] = None):
-        autogen_name = False
-        if name is None:
-            name = "_input_" + str(get_and_increment_equation_counter())
-            autogen_name = True
-        if name in _name_set:
+        circuit = _current_circuit.get()
+        if circuit.recorder is not None:
+            circuit.recorder.replayable = False
+        if name in circuit.names:
             raise ValueError(f"The variable name '{name}' is already used!")
-        super().__init__(name, bus_size, autogen_name)
-        _input_list.append(self)
+        super().__init__(name, bus_size, name is None)
+        circuit.inputs.append(self)
     def __str__(self) -> str:
         return self.name
 
-class EquationVariable(Variable):
+class HashConsingMeta(abc.ABCMeta):
+    '''Metaclass looking up structurally identical equations when hash-consing is enabled'''
+    def __call__(cls, *args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+        circuit = _current_circuit.get()
+        if circuit.recorder is not None:
+            return circuit.recorder.call(cls, args, kwargs)
+        if not circuit.hash_consing or not getattr(cls, 'hash_consing', False) or kwargs:
+            return super().__call__(*args, **kwargs)
+        # Operands are compared by identity, other parameters by value
+        key = (cls,) + (tuple(sorted(args, key=id)) if getattr(cls, 'commutative', False) else args)
+        eq = circuit.hash_consing_table.get(key)
+        if eq is None:
+            eq = super().__call__(*args)
+            circuit.hash_consing_table[key] = eq
+        return eq
+
+class EquationVariable(Variable, metaclass=HashConsingMeta):
     '''A standard netlist variable'''
+    __slots__ = ()
+    operand_names: typing.ClassVar[typing.Tuple[str, ...]] = ()
+    # Operands whose value of the current cycle is read, when not all of them (see `combinational_operands`)
+    combinational_operand_names: typing.ClassVar[typing.Optional[typing.Tuple[str, ...]]] = None
+    hash_consing: typing.ClassVar[bool] = False
+    commutative: typing.ClassVar[bool] = False
     def __init__(self, bus_size: int):
-        while True:
-            name = "_l_" + str(get_and_increment_equation_counter())
-            if name not in _name_set:
-                break
-        super().__init__(name, bus_size)
-        _equation_list.append(self)
+        super().__init__(None, bus_size)
+        circuit = _current_circuit.get()
+        circuit.equations.append(self)
+        if circuit.profiler is not None:
+            circuit.profiler.record(self)
+    def get_operands(self) -> typing.Tuple[Variable, ...]:
+        '''Returns the (resolved) variables read by this equation'''
+        return tuple(getattr(self, x).get_val() for x in self.operand_names)
 
 class Constant(EquationVariable):
     '''Netlist constant'''
+    __slots__ = ('value',)
+    hash_consing = True
     def __init__(self, value: str):
         if len(value) == 0:
             raise ValueError("Defining an empty constant is not allowed")
@@ -183,9 +387,12 @@ class Constant(EquationVariable):
 
 class Unop(EquationVariable):
     '''Netlist unary operations on variables'''
+    __slots__ = ('x',)
     unop_name = ""
+    operand_names = ('x',)
+    hash_consing = True
     def __init__(self, x: VariableOrDefer):
-        if not _ALLOW_RIBBON_LOGIC_OPERATIONS and x.bus_size != 1:
+        if x.bus_size != 1 and not _current_circuit.get().allow_ribbon_logic_operations:
             raise ValueError(f"Unops can only be performed on signals of bus size 1 (have {x.bus_size}). "
                              + "If your simulator handles ribbons logic operations, "
                              + "call `allow_ribbon_logic_operations(True)`")
@@ -198,19 +405,25 @@ class Unop(EquationVariable):
 
 class Not(Unop):
     '''Netlist NOT'''
+    __slots__ = ()
     unop_name = "NOT"
 
 class Reg(Unop):
     '''Netlist REG'''
+    __slots__ = ()
     unop_name = "REG"
+    combinational_operand_names = ()
 
 class Binop(EquationVariable):
     '''Netlist binary operations on variables'''
+    __slots__ = ('lhs', 'rhs')
     binop_name = ""
+    operand_names = ('lhs', 'rhs')
+    hash_consing = True
     def __init__(self, lhs: VariableOrDefer, rhsB: VariableOrDefer):
         if lhs.bus_size != rhsB.bus_size:
             raise ValueError(f"Operands have different bus sizes: {lhs.bus_size} and {rhsB.bus_size}")
-        if not _ALLOW_RIBBON_LOGIC_OPERATIONS and lhs.bus_size != 1:
+        if lhs.bus_size != 1 and not _current_circuit.get().allow_ribbon_logic_operations:
             raise ValueError(f"Binops can only be performed on signals of bus size 1 (have {lhs.bus_size}). "
                              + "If your simulator handles ribbons logic operations, "
                              + "call `allow_ribbon_logic_operations(True)`")
@@ -224,19 +437,30 @@ class Binop(EquationVariable):
 
 class And(Binop):
     '''Netlist AND'''
+    __slots__ = ()
     binop_name = "AND"
+    commutative = True
 class Nand(Binop):
     '''Netlist NAND'''
+    __slots__ = ()
     binop_name = "NAND"
+    commutative = True
 class Or(Binop):
     '''Netlist OR'''
+    __slots__ = ()
     binop_name = "OR"
+    commutative = True
 class Xor(Binop):
     '''Netlist XOR'''
+    __slots__ = ()
     binop_name = "XOR"
+    commutative = True
 
 class Mux(EquationVariable):
     '''Netlist MUX'''
+    __slots__ = ('choice', 'a', 'b')
+    operand_names = ('choice', 'a', 'b')
+    hash_consing = True
     def __init__(self, choice: VariableOrDefer, a: VariableOrDefer, b: VariableOrDefer):
         if choice.bus_size != 1:
             raise ValueError(f"MUX choice bus size must be 1, have {choice.bus_size}")
@@ -251,6 +475,8 @@ class Mux(EquationVariable):
 
 class ROM(EquationVariable):
     '''Netlist ROM'''
+    __slots__ = ('addr_size', 'word_size', 'read_addr')
+    operand_names = ('read_addr',)
     def __init__(self, addr_size: int, word_size: int, read_addr: VariableOrDefer):
         if read_addr.bus_size != addr_size:
             raise ValueError(f"ROM read address bus size ({read_addr.bus_size}) must be equal "
@@ -264,8 +490,12 @@ class ROM(EquationVariable):
 
 class RAM(EquationVariable):
     '''Netlist RAM'''
+    __slots__ = ('addr_size', 'word_size', 'read_addr', 'write_enable', 'write_addr', 'write_data')
+    operand_names = ('read_addr', 'write_enable', 'write_addr', 'write_data')
+    combinational_operand_names = ('read_addr',)
     def __init__(self, addr_size: int, word_size: int, read_addr: VariableOrDefer,
                  write_enable: VariableOrDefer, write_addr: VariableOrDefer, write_data: VariableOrDefer):
+        # pylint: disable=R0917
         if read_addr.bus_size != addr_size:
             raise ValueError(f"RAM read address bus size ({read_addr.bus_size}) must be equal "
                 + "to addr_size ({addr_size})")
@@ -290,6 +520,9 @@ class RAM(EquationVariable):
 
 class Concat(EquationVariable):
     '''Netlist CONCAT'''
+    __slots__ = ('lhs', 'rhs')
+    operand_names = ('lhs', 'rhs')
+    hash_consing = True
     def __init__(self, lhs: VariableOrDefer, rhs: VariableOrDefer):
         super().__init__(lhs.bus_size + rhs.bus_size)
         self.lhs = lhs
@@ -299,6 +532,9 @@ class Concat(EquationVariable):
 
 class Slice(EquationVariable):
     '''Netlist SLICE'''
+    __slots__ = ('i1', 'i2', 'x')
+    operand_names = ('x',)
+    hash_consing = True
     def __init__(self, i1: int, i2: int, x: VariableOrDefer):
         if not 0 <= i1 < i2 <= x.bus_size:
             raise IndexError(f"Slice must satisfy `0 <= i1 < i2 <= bus_size`, i.e. {0} <= {i1} < {i2} <= {x.bus_size}")
@@ -306,59 +542,284 @@ class Slice(EquationVariable):
         self.i1 = i1
         self.i2 = i2-1
         self.x = x
-        if not x.autogen_name and '_slc_' not in x.name:
-            self.try_rename(('' if x.name.startswith('_') else '_') + x.name + '_slc_' +
+        self.name_after_operand()
+    def name_after_operand(self) -> None:
+        '''Name the slice after its operand, if the operand has a chosen name'''
+        if not self.x.autogen_name and '_slc_' not in self.x.name:
+            self.try_rename(('' if self.x.name.startswith('_') else '_') + self.x.name + '_slc_' +
                             str(self.i1) + '_' + str(self.i2), True)
     def __str__(self) -> str:
         return f"{self.name} = SLICE {self.i1} {self.i2} {self.x.name}"
 
 class Select(EquationVariable):
     '''Netlist SELECT'''
+    __slots__ = ('i', 'x')
+    operand_names = ('x',)
+    hash_consing = True
     def __init__(self, i: int, x: VariableOrDefer):
         if not 0 <= i < x.bus_size:
             raise IndexError(f"Select must satisfy `0 <= i < bus_size`, i.e. {0} <= {i} < {x.bus_size}")
         super().__init__(1)
         self.i = i
         self.x = x
-        if not x.autogen_name:
-            self.try_rename(('' if x.name.startswith('_') else '_') + x.name + '_sel_' + str(i), True)
+        self.name_after_operand()
+    def name_after_operand(self) -> None:
+        '''Name the selection after its operand, if the operand has a chosen name'''
+        if not self.x.autogen_name:
+            self.try_rename(('' if self.x.name.startswith('_') else '_') + self.x.name + '_sel_' + str(self.i), True)
     def __str__(self) -> str:
         return f"{self.name} = SELECT {self.i} {self.x.name}"
 
-def get_netlist() -> str:
-    '''Get the netlist in string form'''
-
-    # The equations might contain Defer nodes that are not yet evaluated,
-    # and their evaluation could create new equations.
-    # This loop evaluates all Defer nodes (and subsequent Defer nodes that could
-    # be created by the evaluation of the previous ones)
-    while len(_unevaluated_defer_set) != 0:
-        for defer in list(_unevaluated_defer_set):
-            defer.get_val()
-
-    old_lens = (len(_input_list), len(_output_list), len(_equation_list))
-
-    netlist = (
-        ""
-        + "INPUT " + ", ".join(x.name for x in _input_list) + "\n"
-        + "OUTPUT " + ", ".join(x.name for x in _output_list) + "\n"
-        + "VAR " + ", ".join(x.get_full_name() for x in _input_list + _equation_list) + "\n"
-        + "IN" + "\n"
-        + "".join(str(x) + "\n" for x in _equation_list)
-    )
-
-    # Sanity check
-    new_lens = (len(_input_list), len(_output_list), len(_equation_list))
-    if new_lens != old_lens:
-        raise RuntimeError("Internal error: inconsistent lengths, please report a bug")
-
-    return netlist
+def concat_all(variables: typing.Iterable[Variable]) -> Variable:
+    '''Concatenate the variables in order, without recursion (same netlist as `s = s + x` in a loop)'''
+    result: typing.Optional[Variable] = None
+    for x in variables:
+        result = x if result is None else Concat(result, x)
+    if result is None:
+        raise ValueError("Cannot concatenate an empty sequence of variables")
+    return result
+
+def reg_bus(bus_size: int, lazy_val: typing.Callable[[], Variable]) -> Variable:
+    '''Registers of the bits of `lazy_val()`, which may be built after them (e.g. a feedback loop)
+
+    There is one REG per bit, as a bus-wide REG needs ribbon logic operations.'''
+    value = Defer(bus_size, lazy_val)
+    def bit(i: int) -> Variable:
+        return Reg(Defer(1, lambda: value.get_val()[i]))
+    return concat_all([bit(i) for i in range(bus_size)])
+
+def combinational_operands(eq: EquationVariable) -> typing.Tuple[Variable, ...]:
+    '''Operands whose value of the current cycle is needed to compute `eq`'''
+    # REG and RAM outputs only depend on the previous cycle, except for the RAM read address
+    names = eq.combinational_operand_names
+    return tuple(getattr(eq, x).get_val() for x in (eq.operand_names if names is None else names))
+
+def combinational_levels(equations: typing.Sequence[EquationVariable]) -> typing.Dict[EquationVariable, int]:
+    '''Level of each equation, in an order where each equation comes after the equations it combinationally reads
+
+    The level is 0 when the equation reads no equation of the current cycle, else 1 + the highest level it reads.'''
+    # Kahn's algorithm
+    equation_set = set(equations)
+    pending: typing.Dict[EquationVariable, int] = {}
+    readers: typing.Dict[Variable, typing.List[EquationVariable]] = {}
+    ready: typing.List[EquationVariable] = []
+    for eq in equations:
+        operands = [x for x in combinational_operands(eq) if x in equation_set]
+        pending[eq] = len(operands)
+        for x in operands:
+            readers.setdefault(x, []).append(eq)
+        if not operands:
+            ready.append(eq)
+    ready.reverse()
+    levels: typing.Dict[EquationVariable, int] = {}
+    reader_levels: typing.Dict[EquationVariable, int] = {}
+    while ready:
+        eq = ready.pop()
+        level = levels[eq] = reader_levels.get(eq, 0)
+        for reader in readers.get(eq, ()):
+            if reader_levels.get(reader, 0) <= level:
+                reader_levels[reader] = level + 1
+            pending[reader] -= 1
+            if pending[reader] == 0:
+                ready.append(reader)
+    if len(levels) != len(equations):
+        loop = ", ".join(eq.name for eq in equations if pending[eq] != 0)
+        raise ValueError(f"Combinational loop in the netlist, involving: {loop}")
+    return levels
+
+def schedule(equations: typing.Sequence[EquationVariable]) -> typing.List[EquationVariable]:
+    '''Order the equations so that each one comes after the equations it combinationally reads'''
+    return list(combinational_levels(equations))
+
+class BlockRecorder:
+    '''Records the construction of a block, and generates the function stamping out copies of it
+
+    The equations of lib_carotte classes are copied attribute by attribute,
+    the other calls (e.g. the renaming hooks) are replayed with the new variables.'''
+    def __init__(self, circuit: Circuit, args: typing.Sequence[typing.Any]):
+        self.circuit = circuit
+        self.replayable = True
+        self.constants: typing.List[typing.Any] = []
+        self.local_names: typing.Dict[VariableOrDefer, str] = {}
+        self.lines: typing.List[str] = []
+        for (k, x) in enumerate(args):
+            if isinstance(x, (Variable, Defer)) and x not in self.local_names:
+                self.local_names[x] = f"v{len(self.local_names)}"
+                self.lines.append(f"    {self.local_names[x]} = args[{k}]")
+
+    def local(self, x: typing.Any) -> str:
+        '''Python expression of the value `x` in the generated function'''
+        if isinstance(x, (Variable, Defer)) and x in self.local_names:
+            return self.local_names[x]
+        if type(x) in (int, str, bool, type(None)):
+            return repr(x)
+        self.constants.append(x)
+        return f"k[{len(self.constants) - 1}]"
+
+    def new_local(self, x: VariableOrDefer) -> str:
+        '''Name a new variable of the recorded block'''
+        self.local_names[x] = f"v{len(self.local_names)}"
+        return self.local_names[x]
+
+    def call(self, function: typing.Callable[..., typing.Any], args: typing.Sequence[typing.Any],
+             kwargs: typing.Dict[str, typing.Any]) -> typing.Any:
+        '''Call `function` and record the call'''
+        self.circuit.recorder = None
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            self.circuit.recorder = self
+        if not self.replayable:
+            return result
+        if (isinstance(function, type) and issubclass(function, EquationVariable)
+                and function.__module__ == __name__ and not kwargs):
+            self.stamp(result)
+            return result
+        call = (f"{self.local(function)}(" + ", ".join([self.local(x) for x in args] +
+                [f"{name}={self.local(x)}" for (name, x) in kwargs.items()]) + ")")
+        if isinstance(result, (Variable, Defer)):
+            call = f"{self.new_local(result)} = {call}"
+        # The equation counter is kept in a local variable between the calls
+        self.lines += ["    circuit.equation_counter = n", f"    {call}", "    n = circuit.equation_counter"]
+        return result
+
+    def stamp(self, eq: EquationVariable) -> None:
+        '''Record the creation of `eq`'''
+        cls = type(eq)
+        parameters = [name for klass in cls.__mro__ for name in getattr(klass, '__slots__', ())
+                      if name not in Variable.__slots__ and name not in cls.operand_names]
+        operands = [self.local(getattr(eq, name)) for name in cls.operand_names]
+        local = self.new_local(eq)
+        self.lines += [f"    {local} = new({self.local(cls)})",
+                       f"    {local}.chosen_name = None",
+                       f"    {local}.id = n",
+                       "    n += 1",
+                       f"    {local}.autogen_name = True",
+                       f"    {local}.bus_size = {eq.bus_size}"]
+        self.lines += [f"    {local}.{name} = {self.local(getattr(eq, name))}" for name in parameters]
+        self.lines += [f"    {local}.{name} = {operand}" for (name, operand) in zip(cls.operand_names, operands)]
+        self.lines.append(f"    equations.append({local})")
+        if isinstance(eq, (Slice, Select)):
+            self.lines.append(f"    {local}.name_after_operand()")
+
+    def result(self, x: typing.Any) -> str:
+        '''Python expression of the block result in the generated function'''
+        if type(x) in (tuple, list):
+            items = "".join(self.result(y) + ", " for y in x)
+            return f"({items})" if isinstance(x, tuple) else f"[{items}]"
+        return self.local(x)
+
+    def compile(self, result: typing.Any, name: str) -> typing.Optional[typing.Callable[..., typing.Any]]:
+        '''The function stamping out a copy of the recorded block, if the block can be replayed'''
+        if not self.replayable:
+            return None
+        lines = ["def stamp(circuit, args):",
+                 "    equations = circuit.equations",
+                 "    n = circuit.equation_counter"]
+        lines += self.lines
+        lines += ["    circuit.equation_counter = n",
+                  f"    return {self.result(result)}"]
+        namespace: typing.Dict[str, typing.Any] = {'new': object.__new__, 'k': self.constants}
+        exec(compile("\n".join(lines) + "\n", f"<block template {name}>", "exec"), namespace) # pylint: disable=W0122
+        return typing.cast(typing.Callable[..., typing.Any], namespace["stamp"])
+
+class BlockTemplate:
+    '''A block built once per kind of arguments, then stamped out without running its python code again
+
+    The arguments are compared by bus size for the variables and by value for the others,
+    so the block must only depend on them (and not e.g. on global variables).
+    Blocks creating INPUT or Defer nodes are built normally at each call.'''
+    def __init__(self, function: typing.Callable[..., typing.Any]):
+        functools.update_wrapper(self, function)
+        self.function = function
+        self.stamps: typing.Dict[typing.Tuple[typing.Any, ...], typing.Optional[typing.Callable[..., typing.Any]]] = {}
+
+    def key(self, circuit: Circuit,
+            args: typing.Sequence[typing.Any]) -> typing.Optional[typing.Tuple[typing.Any, ...]]:
+        '''The arguments and options determining the recorded block, if they are hashable'''
+        first_positions: typing.Dict[VariableOrDefer, int] = {}
+        key: typing.List[typing.Any] = [circuit.allow_ribbon_logic_operations]
+        for (k, x) in enumerate(args):
+            if isinstance(x, (Variable, Defer)):
+                # The same variable passed twice gives a different block
+                key.append((Variable, x.bus_size, first_positions.setdefault(x, k)))
+            else:
+                key.append((type(x), x))
+        try:
+            hash(tuple(key))
+        except TypeError:
+            return None
+        return tuple(key)
+
+    def __call__(self, *args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+        circuit = _current_circuit.get()
+        # The stamped out equations are not profiled: the block is built normally when profiling
+        key = (None if kwargs or circuit.recorder is not None or circuit.hash_consing or circuit.profiler is not None
+               else self.key(circuit, args))
+        if key is None:
+            return self.function(*args, **kwargs)
+        if key in self.stamps:
+            stamp = self.stamps[key]
+            return self.function(*args) if stamp is None else stamp(circuit, args)
+        recorder = BlockRecorder(circuit, args)
+        circuit.recorder = recorder
+        try:
+            result = self.function(*args)
+        finally:
+            circuit.recorder = None
+        self.stamps[key] = recorder.compile(result, self.function.__name__)
+        return result
+
+Function = typing.TypeVar('Function', bound=typing.Callable[..., typing.Any])
+
+def block_template(function: Function) -> Function:
+    '''Decorator building a block once per kind of arguments, see `BlockTemplate`'''
+    return typing.cast(Function, BlockTemplate(function))
+
+def resolve_defers() -> None:
+    '''Evaluate all pending Defer nodes of the active circuit'''
+    _current_circuit.get().resolve_defers()
+
+def get_inputs() -> typing.List[Variable]:
+    '''Get the netlist INPUT variables'''
+    return _current_circuit.get().inputs
+
+def get_outputs() -> typing.List[Variable]:
+    '''Get the netlist OUTPUT variables'''
+    return _current_circuit.get().outputs
+
+def get_equations() -> typing.List[EquationVariable]:
+    '''Get the netlist equations, in creation order'''
+    return _current_circuit.get().equations
+
+def set_equations(equations: typing.List[EquationVariable]) -> None:
+    '''Replace the netlist equations, e.g. after an optimization pass'''
+    _current_circuit.get().set_equations(equations)
+
+NETLIST_CHUNK_SIZE = 4096
+
+def write_chunked(f: typing.TextIO, items: typing.Iterable[str], separator: str) -> None:
+    '''Write the items separated by `separator`, a few thousands at a time'''
+    iterator = iter(items)
+    chunk = separator.join(itertools.islice(iterator, NETLIST_CHUNK_SIZE))
+    while chunk:
+        f.write(chunk)
+        chunk = separator.join(itertools.islice(iterator, NETLIST_CHUNK_SIZE))
+        if chunk:
+            f.write(separator)
+
+def resolve_names() -> None:
+    '''Give a new name to the variables whose automatic name has been chosen by another variable'''
+    _current_circuit.get().resolve_names()
+
+def write_netlist(f: typing.TextIO, levelized: bool = False, annotate_levels: bool = False) -> None:
+    '''Write the netlist to a text file, without building it in memory, see `Circuit.write_netlist`'''
+    _current_circuit.get().write_netlist(f, levelized, annotate_levels)
+
+def get_netlist(levelized: bool = False, annotate_levels: bool = False) -> str:
+    '''Get the netlist in string form, see `Circuit.write_netlist` for the options'''
+    return _current_circuit.get().get_netlist(levelized, annotate_levels)
 
 def reset() -> None:
     '''Reset the netlist'''
-    global _equation_counter, _input_list, _equation_list, _output_list, _name_set # pylint: disable=W0603
-    _equation_counter = 0
-    _input_list = []
-    _equation_list = []
-    _output_list = []
-    _name_set = set()
+    _current_circuit.get().reset()
@@ -0,0 +1,35 @@
+'''Regression test for the batch simulation, lane by lane against the scalar simulation'''
+
+import random
+
+import carotte_sim
+from lib_carotte import *
+
+
+def main() -> None:
+    '''Regression test for the batch simulation, lane by lane against the scalar simulation'''
+    addr = Input(3, "addr")
+    write_enable = Input(1, "we")
+    data = Input(4, "data")
+    # Accumulates the RAM reads into a register
+    total = reg_bus(4, lambda: new_total)
+    ram = RAM(3, 4, addr, write_enable, addr, Mux(write_enable, total, data))
+    new_total = concat_all([Mux(data[i], total[i] ^ ram[i], ram[i] & total[i]) for i in range(4)])
+    total.set_as_output("total")
+    ram.set_as_output("ram")
+    if carotte_sim.np is None:
+        return
+    lanes = 100
+    rng = random.Random(0)
+    inputs = [{"addr": [rng.randrange(8) for _ in range(lanes)], "we": [rng.randrange(2) for _ in range(lanes)],
+               "data": [rng.randrange(16) for _ in range(lanes)]} for _ in range(30)]
+    outputs = list(carotte_sim.BatchSimulator(lanes).simulate(inputs))
+    for lane in range(lanes):
+        expected = carotte_sim.simulate([{name: values[lane] for (name, values) in cycle.items()} for cycle in inputs])
+        assert [{name: int(values[lane]) for (name, values) in cycle.items()} for cycle in outputs] == list(expected)
+    assert any(cycle["total"].any() for cycle in outputs)
+    try:
+        carotte_sim.BatchSimulator(lanes).step(dict(inputs[0], data=[16] * lanes))
+        assert False
+    except ValueError as e:
+        assert str(e) == "Value 16 of input 'data' (lane 0) does not fit in 4 bits"
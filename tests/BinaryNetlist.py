@@ -0,0 +1,30 @@
+'''Regression test for the binary netlist'''
+
+import os
+import tempfile
+
+import carotte_binary
+from lib_carotte import *
+
+
+def main() -> None:
+    '''Regression test for the binary netlist'''
+    allow_ribbon_logic_operations(True)
+    a = Input(4)
+    b = Input(4, "b")
+    c = Constant("01tf")
+    x = Mux(a[0], (a & b) | ~Nand(b, c), Reg(a ^ c))
+    rom = ROM(2, 4, x[1:3])
+    ram = RAM(2, 4, x[0:2], b[3], a[2:4], rom)
+    ram.set_as_output("ram")
+    (x + b[0]).set_as_output()
+    Not(Input(1)).set_as_output("n")
+    (fd, filename) = tempfile.mkstemp(suffix=".bin")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            carotte_binary.write_binary_netlist(f)
+        with carotte_binary.BinaryNetlist(filename) as netlist:
+            assert netlist.get_netlist() == get_netlist()
+    finally:
+        os.remove(filename)
+    allow_ribbon_logic_operations(False)
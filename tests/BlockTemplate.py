@@ -0,0 +1,32 @@
+'''Regression test for block templates'''
+
+from lib_carotte import *
+
+
+@block_template
+def majority(a: Variable, b: Variable, c: Variable) -> typing.Tuple[Variable, Variable]:
+    '''Majority and parity of three bits'''
+    ab = a & b
+    parity = a ^ b ^ c
+    return ((ab | (a & c)) | (b & c), parity)
+
+@block_template
+def window(x: Variable, i: int) -> Variable:
+    '''Two bits of `x`, starting at bit i'''
+    w = x[i:i+2]
+    return Mux(w[1], w[0], x[0])
+
+def main() -> None:
+    '''Regression test for block templates'''
+    x = Input(4)
+    y = Input(4)
+    c: Variable
+    c = Constant("0")
+    for i in range(4):
+        (c, p) = majority(x[i], y[i], c)
+        p.set_as_output("p" + str(i))
+    c.set_as_output("carry")
+    (m, _) = majority(x[0], x[0], y[0])
+    m.set_as_output("m")
+    for i in range(3):
+        window(x, i).set_as_output("w" + str(i))
@@ -0,0 +1,16 @@
+'''Regression test for the Circuit context'''
+
+from lib_carotte import *
+
+
+def main() -> None:
+    '''Regression test for the Circuit context'''
+    a = Input(1)
+    with Circuit(ribbon_logic_operations=True) as other:
+        # Names are per circuit
+        b = Input(2, "a")
+        (b & b).set_as_output("d")
+        assert len(get_equations()) == 1
+    assert len(other.get_netlist().splitlines()) == 5
+    c = Not(a)
+    c.set_as_output("c")
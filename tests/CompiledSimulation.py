@@ -0,0 +1,29 @@
+'''Regression test for the compiled simulation'''
+
+import random
+
+import carotte_sim
+from examples import nadder
+from lib_carotte import *
+
+
+def main() -> None:
+    '''Regression test for the compiled simulation'''
+    a = Input(4, "a")
+    write_enable = Input(1, "we")
+    # Accumulator, whose sums are written to the RAM and read back at the next address
+    total = reg_bus(4, lambda: sum_bits)
+    (sum_bits, carry) = nadder.adder(total, a, Constant("0"))
+    ram = RAM(4, 4, a, write_enable, a, sum_bits)
+    rom = ROM(4, 4, ram)
+    (Nand(carry, write_enable) + (rom[0] | sum_bits[2]) + Slice(1, 3, rom)).set_as_output("o")
+    total.set_as_output("total")
+    ram.set_as_output("ram")
+    roms = {rom.name: [15 - k for k in range(16)]}
+    rng = random.Random(0)
+    inputs = [{"a": rng.randrange(16), "we": rng.randrange(2)} for _ in range(100)]
+    simulator = carotte_sim.CompiledSimulator(roms)
+    assert list(simulator.simulate(inputs)) == list(carotte_sim.simulate(inputs, roms))
+    # The same netlist reuses the compiled code
+    assert carotte_sim.CompiledSimulator(roms).code is simulator.code
+    assert carotte_sim._code_cache[simulator.source] is simulator.code # pylint: disable=W0212
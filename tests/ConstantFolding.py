@@ -0,0 +1,28 @@
+'''Regression test for constant propagation and dead logic elimination'''
+
+import carotte_opt
+from lib_carotte import *
+
+
+def main() -> None:
+    '''Regression test for constant propagation and dead logic elimination'''
+    a = Input(2)
+    b = Input(1)
+    zero = Constant("0")
+    one = ~zero
+    x = (a[0] & one) | (b & zero)
+    Reg(a[1] ^ x)
+    y = Mux(one, x, b) ^ Constant("1")
+    k = Constant("10") + Constant("1")
+    z = Reg(zero)
+    y.set_as_output("y")
+    (k + b).set_as_output("kb")
+    (b & b).set_as_output("b_and_b")
+    (z ^ x).set_as_output("zx")
+    # Bus-wide gates are folded into bus-wide gates, even once ribbon logic operations are disabled
+    allow_ribbon_logic_operations(True)
+    c = Input(2)
+    (c ^ Constant("11")).set_as_output("not_c")
+    (c & Constant("11")).set_as_output("c_and_ones")
+    allow_ribbon_logic_operations(False)
+    carotte_opt.optimize()
@@ -0,0 +1,25 @@
+'''Regression test for the event-driven simulation'''
+
+import carotte_sim
+from examples import nadder
+from lib_carotte import *
+
+
+def main() -> None:
+    '''Regression test for the event-driven simulation'''
+    enable = Input(1, "enable")
+    # 8-bit counter, incremented when enabled
+    count = reg_bus(8, lambda: incremented)
+    (incremented, _) = nadder.adder(count, Constant("00000000"), enable)
+    # The RAM keeps the count it had when enabled
+    ram = RAM(1, 8, Constant("0"), enable, Constant("0"), count)
+    count.set_as_output("count")
+    ram.set_as_output("ram")
+    inputs = [{"enable": int(k % 10 == 0)} for k in range(50)]
+    expected = list(carotte_sim.simulate(inputs))
+    assert expected[-1] == {"count": 5, "ram": 4}
+    for threshold in (0., 1., carotte_sim.DEFAULT_ACTIVITY_THRESHOLD):
+        simulator = carotte_sim.EventSimulator(activity_threshold=threshold)
+        assert list(simulator.simulate(inputs)) == expected
+        # The first cycle is always a full sweep
+        assert simulator.event_cycles == (0 if threshold == 0 else len(inputs) - 1)
@@ -0,0 +1,47 @@
+'''Regression test for the attribution of the equations to the functions building them'''
+
+import io
+
+import carotte_profile
+from lib_carotte import *
+
+
+@block_template
+def majority(a: Variable, b: Variable, c: Variable) -> Variable:
+    '''Majority gate, stamped out when not profiling'''
+    return (a & b) | (a & c) | (b & c)
+
+def vote(a: Variable, b: Variable) -> Variable:
+    '''Bitwise majority of a, b and a constant'''
+    # A loop rather than a list comprehension, which has its own frame before python 3.12
+    bits = []
+    for i in range(a.bus_size):
+        bits.append(majority(a[i], b[i], Constant("1")))
+    return concat_all(bits)
+
+def main() -> None:
+    '''Regression test for the attribution of the equations to the functions building them'''
+    a = Input(4)
+    b = Input(4)
+    with carotte_profile.Profiler() as profiler:
+        x = vote(a, b)
+        y = Reg(x[0])
+    y.set_as_output("y")
+    flat = {code.co_name if code else None: statistics for (code, statistics) in profiler.flat().items()}
+    assert dict(flat["majority"].gates) == {"And": 12, "Or": 8}
+    assert dict(flat["vote"].gates) == {"Select": 8, "Constant": 4, "Concat": 3}
+    assert flat["vote"].bits == 8 + 4 + 2 + 3 + 4
+    assert dict(flat["main"].gates) == {"Select": 1, "Reg": 1}
+    tree = profiler.tree()
+    assert sum(tree.statistics.gates.values()) == 37
+    # The frames above main are the ones of the script running the test
+    node = tree
+    while main.__code__ not in node.children:
+        node = next(iter(node.children.values()))
+    (vote_node,) = (node for (code, node) in node.children[main.__code__].children.items() if code.co_name == "vote")
+    assert sum(vote_node.statistics.gates.values()) == 35
+    assert isinstance(x, EquationVariable)
+    assert [function for (_, function, _) in profiler.origin(x)][-2:] == ["main", "vote"]
+    report = io.StringIO()
+    profiler.report(report)
+    assert report.getvalue().startswith("37 equations, 43 bits")
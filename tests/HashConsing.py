@@ -0,0 +1,20 @@
+'''Regression test for hash-consing'''
+
+from lib_carotte import *
+
+
+def main() -> None:
+    '''Regression test for hash-consing'''
+    enable_hash_consing(True)
+    a = Input(2)
+    b = Input(2)
+    x = (a[0] & b[0]) | (b[0] & a[0])
+    y = a[0] & b[0]
+    z = Mux(x, y, Constant("1")) ^ Mux(x, a[0] & b[0], Constant("1"))
+    r = Reg(z)
+    r.set_as_output("r")
+    (a[0:2] + b[1]).set_as_output("c")
+    # The shared gate is an OUTPUT once, then a copy of it
+    a[1].set_as_output("p")
+    a[1].set_as_output("q")
+    enable_hash_consing(False)
@@ -0,0 +1,32 @@
+'''Regression test for the levelized netlist'''
+
+from lib_carotte import *
+
+
+def main() -> None:
+    '''Regression test for the levelized netlist'''
+    a = Input(1, "a")
+    # Created before the gates it reads
+    x = Mux(a, Defer(1, lambda: y), Defer(1, lambda: z))
+    x.rename("x")
+    y = Not(Defer(1, lambda: r))
+    y.rename("y")
+    z = a ^ y
+    z.rename("z")
+    r = Reg(x)
+    r.set_as_output("o")
+    assert get_netlist(annotate_levels=True) == '''INPUT a
+OUTPUT o
+VAR a, o, y, z, x
+IN
+# level 0
+o = REG x
+# level 1
+y = NOT o
+# level 2
+z = XOR a y
+# level 3
+x = MUX a y z
+'''
+    assert get_netlist(levelized=True) == "".join(line for line in get_netlist(annotate_levels=True).splitlines(True)
+                                                  if not line.startswith("#"))
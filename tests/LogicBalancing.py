@@ -0,0 +1,30 @@
+'''Regression test for the balancing of the AND/OR/XOR chains'''
+
+import functools
+
+import carotte_opt
+from lib_carotte import *
+
+
+def main() -> None:
+    '''Regression test for the balancing of the AND/OR/XOR chains'''
+    a = Input(8)
+    b = Input(1)
+    any_bit = functools.reduce(lambda x, y: x | y, a)
+    any_bit.set_as_output("any")
+    # The last operand is deeper: it stays at the top of the tree
+    parity = functools.reduce(lambda x, y: x ^ y, list(a[0:4]) + [a[4] & b & a[5]])
+    parity.set_as_output("parity")
+    # An OUTPUT in the middle of a chain ends the chain
+    half = a[0] & a[1] & a[2]
+    half.set_as_output("half")
+    (half & a[3] & a[4] & a[5] & a[6]).set_as_output("all")
+    # Bus-wide chains are balanced into bus-wide gates, even once ribbon logic operations are disabled
+    allow_ribbon_logic_operations(True)
+    c = Input(2)
+    d = Input(2)
+    (c & d & a[0:2] & a[2:4] & a[4:6]).set_as_output("all_buses")
+    allow_ribbon_logic_operations(False)
+    assert carotte_opt.logic_depth() == 7
+    carotte_opt.balance_logic()
+    assert carotte_opt.logic_depth() == 3
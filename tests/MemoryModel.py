@@ -0,0 +1,50 @@
+'''Regression test for the ROM images and the paged RAM of the simulators'''
+
+import os
+import tempfile
+
+import carotte_memory
+import carotte_sim
+from lib_carotte import *
+
+INPUTS = [{"addr": 1, "we": 1, "wa": 0xfedcba, "ra": 0}, {"addr": 3, "we": 1, "wa": 7, "ra": 0xfedcba},
+          {"addr": 0, "we": 0, "wa": 7, "ra": 7}]
+EXPECTED = [{"rom": 0xabc, "rom_hex": 0xabc, "ram": 0}, {"rom": 0xfff, "rom_hex": 0xfff, "ram": 0xabc},
+            {"rom": 0x123, "rom_hex": 0x123, "ram": 0xfff}]
+
+def check_simulators(roms: typing.Mapping[str, typing.Sequence[int]], directory: str) -> None:
+    '''Simulate with the ROM images, and save and load the RAM contents'''
+    for simulator in (carotte_sim.Simulator(roms), carotte_sim.CompiledSimulator(roms)):
+        assert list(simulator.simulate(INPUTS)) == EXPECTED
+        # One page for each address written
+        (memory,) = simulator.rams.values()
+        assert sorted(memory.pages) == [0, 0xfedcba >> carotte_memory.PAGE_BITS]
+        if carotte_memory.np is not None:
+            simulator.save_memories(os.path.join(directory, "memories.npz"))
+            restored = carotte_sim.Simulator(roms)
+            restored.load_memories(os.path.join(directory, "memories.npz"))
+            assert list(restored.simulate(INPUTS[2:])) == EXPECTED[2:]
+
+def main() -> None:
+    '''Regression test for the ROM images and the paged RAM of the simulators'''
+    addr = Input(2, "addr")
+    rom = ROM(2, 12, addr)
+    rom.set_as_output("rom")
+    rom_hex = ROM(2, 12, addr)
+    rom_hex.set_as_output("rom_hex")
+    RAM(24, 12, Input(24, "ra"), Input(1, "we"), Input(24, "wa"), rom).set_as_output("ram")
+    words = [0x123, 0xabc, 0x0f0, 0xfff]
+    directory = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(directory, "rom.bin"), 'wb') as f:
+            f.write(b"".join(word.to_bytes(2, 'little') for word in words))
+        with open(os.path.join(directory, "rom.hex"), 'w', encoding='utf-8') as f:
+            f.write("\n".join(f"{word:03x}" for word in words))
+        with carotte_memory.RomImage(os.path.join(directory, "rom.bin"), 12) as image:
+            with carotte_memory.RomImage(os.path.join(directory, "rom.hex"), 12) as hex_image:
+                assert list(image) == list(hex_image) == words
+                check_simulators({rom.name: image, rom_hex.name: hex_image}, directory)
+    finally:
+        for filename in os.listdir(directory):
+            os.remove(os.path.join(directory, filename))
+        os.rmdir(directory)
@@ -0,0 +1,30 @@
+'''Regression test for the netlist parser'''
+
+import carotte_parse
+from lib_carotte import *
+
+NETLIST = '''
+# Counter with a forward reference to the next value
+INPUT en
+OUTPUT o, s
+VAR en, c:2, n:2, s, o:3, k:2, o_1:2, o_0:2
+IN
+c = REG n  # defined below
+k = 01
+n = MUX en c o_1
+o_1 = XOR c k
+s = SELECT 1 c
+o = CONCAT o_0 s
+o_0 = SLICE 0 1 n
+'''
+
+def main() -> None:
+    '''Regression test for the netlist parser'''
+    carotte_parse.read_netlist(NETLIST.splitlines())
+    # Parsing the netlist of a parsed netlist gives back the same netlist
+    netlist = get_netlist()
+    circuit = current_circuit()
+    with Circuit():
+        carotte_parse.read_netlist(netlist.splitlines())
+        assert get_netlist() == netlist
+    assert current_circuit() is circuit
@@ -0,0 +1,35 @@
+'''Regression test for the simulation of testbenches with worker processes'''
+
+import os
+import random
+import tempfile
+
+import carotte_memory
+import carotte_sim
+from examples import nadder
+from lib_carotte import *
+
+
+def main() -> None:
+    '''Regression test for the simulation of testbenches with worker processes'''
+    addr = Input(4, "addr")
+    # Accumulates the ROM words, and writes the sum to the RAM
+    total = reg_bus(8, lambda: new_total)
+    rom = ROM(4, 8, addr)
+    (new_total, _) = nadder.adder(total, rom, Constant("0"))
+    ram = RAM(4, 8, addr, Constant("1"), addr, new_total)
+    total.set_as_output("total")
+    ram.set_as_output("ram")
+    rng = random.Random(0)
+    testbenches = [[{"addr": rng.randrange(16)} for _ in range(20 + k)] for k in range(6)]
+    (fd, filename) = tempfile.mkstemp(suffix=".bin")
+    with os.fdopen(fd, 'wb') as f:
+        f.write(bytes(rng.randrange(256) for _ in range(16)))
+    try:
+        with carotte_memory.RomImage(filename, 8) as image:
+            expected = [list(carotte_sim.simulate(inputs, {rom.name: image})) for inputs in testbenches]
+            traces = list(carotte_sim.simulate_parallel(testbenches, {rom.name: image}, jobs=2))
+    finally:
+        os.remove(filename)
+    assert traces == expected
+    assert any(outputs["total"] for outputs in expected[0])
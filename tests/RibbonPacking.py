@@ -0,0 +1,25 @@
+'''Regression test for the packing of per-bit gates into bus-wide gates'''
+
+import functools
+
+import carotte_opt
+from lib_carotte import *
+
+
+def main() -> None:
+    '''Regression test for the packing of per-bit gates into bus-wide gates'''
+    allow_ribbon_logic_operations(True)
+    a = Input(8)
+    b = Input(8)
+    c = Input(1)
+    x = functools.reduce(lambda x, y: x + y, [p | q for (p, q) in zip(a, b)])
+    x.set_as_output("x")
+    # The fifth gate reads other bits: the run is split around it
+    y = concat_all([Mux(c, ~a[i], b[i] ^ Constant("1")) for i in range(4)] + [a[7] & b[0]]
+                   + [a[i] & b[i] for i in range(4, 8)])
+    y.set_as_output("y")
+    # Read twice: not packed
+    z = a[0] & b[0]
+    (z + (a[1] & b[1]) + z).set_as_output("w")
+    carotte_opt.pack_ribbons()
+    allow_ribbon_logic_operations(False)
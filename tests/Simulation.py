@@ -0,0 +1,31 @@
+'''Regression test for the cycle-accurate simulation'''
+
+import carotte_sim
+from lib_carotte import *
+
+
+def main() -> None:
+    '''Regression test for the cycle-accurate simulation'''
+    addr = Input(2, "addr")
+    write_enable = Input(1, "we")
+    data = Input(3, "data")
+    # Defer loop: the register toggles every cycle
+    toggle: Variable = Reg(Defer(1, lambda: ~toggle))
+    toggle.set_as_output("toggle")
+    Reg(data[0]).set_as_output("delayed")
+    RAM(2, 3, addr, write_enable, addr, data).set_as_output("ram")
+    rom = ROM(2, 3, addr)
+    rom.set_as_output("rom")
+    roms = {rom.name: [5, 6, 7]}
+    inputs = [{"addr": 1, "we": 1, "data": 4}, {"addr": 1, "we": 0, "data": 2}, {"addr": 3, "we": 1, "data": 7},
+              {"addr": 3, "we": 0, "data": 0}]
+    expected = [{"toggle": 0, "delayed": 0, "ram": 0, "rom": 6}, {"toggle": 1, "delayed": 0, "ram": 4, "rom": 6},
+                {"toggle": 0, "delayed": 0, "ram": 0, "rom": 0}, {"toggle": 1, "delayed": 1, "ram": 7, "rom": 0}]
+    assert list(carotte_sim.simulate(inputs, roms)) == expected
+    simulator = carotte_sim.Simulator(roms)
+    simulator.step(inputs[0])
+    try:
+        simulator.step({"addr": 4, "we": 0, "data": 0})
+        assert False
+    except ValueError as e:
+        assert str(e) == "Value 4 of input 'addr' does not fit in 2 bits"
@@ -0,0 +1,23 @@
+'''Regression test for the normalization of SELECT/SLICE/CONCAT'''
+
+import carotte_opt
+from lib_carotte import *
+
+
+def main() -> None:
+    '''Regression test for the normalization of SELECT/SLICE/CONCAT'''
+    a = Input(4)
+    b = Input(2)
+    x = a[1:4][0:2]
+    y = (a + b)[5]
+    z = a[0:4][3] ^ b[0:1][0]
+    s = a[0]
+    for i in range(1, 4):
+        s = s + (a[i] ^ b[i % 2])
+    w = a[0] + a[1] + a[2]
+    x.set_as_output("x")
+    y.set_as_output("y")
+    z.set_as_output("z")
+    s.set_as_output("sum")
+    w.set_as_output("w")
+    carotte_opt.normalize_wiring()